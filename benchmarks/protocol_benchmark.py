@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Measures how quickly results can be read from a pipe, comparing the
+# original protocol (a msgpack stream read one byte at a time) with the
+# framed protocol in sqlexecutor.protocol.
+#
+#     python benchmarks/protocol_benchmark.py [row-count]
+
+import os
+import sys
+import time
+
+import msgpack
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlexecutor import protocol
+
+
+def main():
+    if len(sys.argv) > 1:
+        row_count = int(sys.argv[1])
+    else:
+        row_count = 100000
+    
+    message = (
+        None,
+        ["id", "title", "author"],
+        [[index, "Orbiting the Giant Hairball", "Gordon MacKenzie"] for index in range(row_count)],
+    )
+    
+    print "rows: {0}".format(row_count)
+    _report("unframed, read_size=1", _write_unframed, _read_unframed, message)
+    _report("framed", _write_framed(None), _read_framed, message)
+    _report("framed, compressed", _write_framed(0), _read_framed, message)
+
+
+def _report(name, write, read, message):
+    byte_count, elapsed = _measure(write, read, message)
+    print "{0}: {1} bytes in {2:.3f}s, {3:.1f} MB/s".format(
+        name, byte_count, elapsed, byte_count / elapsed / 1e6,
+    )
+
+
+def _measure(write, read, message):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        output = os.fdopen(write_fd, "wb")
+        write(output, message)
+        output.close()
+        os._exit(0)
+    
+    os.close(write_fd)
+    start = time.time()
+    input_file = os.fdopen(read_fd, "rb", 0)
+    read(input_file)
+    elapsed = time.time() - start
+    input_file.close()
+    os.waitpid(pid, 0)
+    return len(msgpack.packb(message)), elapsed
+
+
+def _write_unframed(output, message):
+    msgpack.dump(message, output)
+    output.flush()
+
+
+def _read_unframed(input_file):
+    return next(msgpack.Unpacker(input_file, read_size=1))
+
+
+def _write_framed(compression_threshold):
+    def write(output, message):
+        protocol.write_message(output, message, compression_threshold=compression_threshold)
+    
+    return write
+
+
+def _read_framed(input_file):
+    return next(protocol.read_messages(input_file.fileno()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+# Measures the latency of each stage of running a query, for each dialect,
+# across a range of result sizes and concurrency levels. Results are written
+# as JSON so that runs can be compared:
+#
+#     python benchmarks/stages_benchmark.py --output before.json
+#     python benchmarks/stages_benchmark.py --output after.json --compare before.json
+#
+# To see the effect of a mysqld profile, compare it against the default:
+#
+#     python benchmarks/stages_benchmark.py --dialect mysql --output default.json
+#     python benchmarks/stages_benchmark.py --dialect mysql --mysqld-profile ephemeral --compare default.json
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, _root)
+# Worker processes run sqlexecutor/process.py, which needs to import the
+# same copy of sqlexecutor
+os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [_root, os.environ.get("PYTHONPATH")]))
+
+import sqlexecutor
+
+
+_default_working_dir = os.path.join(_root, "_tests-working-dir")
+
+_slow_queries = {
+    "sqlite3": "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT COUNT(*) FROM numbers",
+    "mysql": "SELECT BENCHMARK(1000000000, SHA1('sqlexecutor'))",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dialect", action="append", dest="dialects")
+    parser.add_argument("--working-dir", default=_default_working_dir)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--row-counts", default="1,1000,100000")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--mysqld-profile", default="default")
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+    
+    dialects = args.dialects or ["sqlite3", "mysql"]
+    row_counts = map(int, args.row_counts.split(","))
+    concurrency_levels = map(int, args.concurrency.split(","))
+    
+    measurements = []
+    for dialect_name in dialects:
+        if dialect_name == "mysql":
+            dialect_options = {"profile": args.mysqld_profile}
+        else:
+            dialect_options = {}
+        benchmark = _DialectBenchmark(
+            dialect_name,
+            args.working_dir,
+            dialect_options,
+            args.repeat,
+            measurements.append,
+        )
+        try:
+            benchmark.run(row_counts, concurrency_levels)
+        except Exception as error:
+            # MySQL can't be benchmarked without a download, so report
+            # the failure and carry on with the other dialects
+            print >> sys.stderr, "{0}: {1}".format(dialect_name, error)
+            measurements.append({"dialect": dialect_name, "error": str(error)})
+    
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "mysqld_profile": args.mysqld_profile,
+        },
+        "measurements": measurements,
+    }
+    
+    if args.output is None:
+        print json.dumps(report, indent=4, sort_keys=True)
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4, sort_keys=True)
+    
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            _print_comparison(json.load(baseline_file), report)
+
+
+class _DialectBenchmark(object):
+    def __init__(self, dialect_name, working_dir, dialect_options, repeat, record):
+        self._dialect_name = dialect_name
+        self._working_dir = os.path.abspath(working_dir)
+        self._dialect_options = dialect_options
+        self._repeat = repeat
+        self._record = record
+    
+    def run(self, row_counts, concurrency_levels):
+        sqlexecutor.prepare(self._dialect_name, self._working_dir, **self._dialect_options)
+        dialect = sqlexecutor._get_dialect(self._dialect_name, self._working_dir, **self._dialect_options)
+        
+        self._measure("server_start", {}, lambda: dialect.start_server().close())
+        # Includes importing sqlexecutor in the new process, which is paid
+        # again whenever a worker is restarted
+        self._measure("worker_start", {}, self._start_worker)
+        
+        server = dialect.start_server()
+        try:
+            self._measure("provision", {}, lambda: server.connect().close())
+            for row_count in row_counts:
+                self._measure(
+                    "creation_script",
+                    {"rows": row_count},
+                    lambda: self._replay(server, _creation_script(row_count)),
+                )
+        finally:
+            server.close()
+        
+        # Snapshots keep the creation script out of the query measurements
+        # once the warm-up run has cached it
+        executor = sqlexecutor.executor(
+            self._dialect_name,
+            self._working_dir,
+            snapshot_cache=sqlexecutor.SnapshotCache(),
+            **self._dialect_options
+        )
+        try:
+            for row_count in row_counts:
+                self._measure_query(executor, "query", row_count)
+        finally:
+            executor.close()
+        
+        subprocess_executor = sqlexecutor.subprocess_executor(
+            self._dialect_name,
+            self._working_dir,
+            snapshot_cache={},
+            dialect_options=self._dialect_options,
+        )
+        try:
+            for row_count in row_counts:
+                self._measure_query(subprocess_executor, "subprocess_query", row_count)
+            self._measure_timeout_recovery(subprocess_executor)
+        finally:
+            subprocess_executor.close()
+        
+        for concurrency in concurrency_levels:
+            self._measure_concurrency(concurrency)
+    
+    def _start_worker(self):
+        executor = sqlexecutor.subprocess_executor(
+            self._dialect_name,
+            self._working_dir,
+            dialect_options=self._dialect_options,
+        )
+        try:
+            executor.start()
+        finally:
+            executor.close()
+    
+    def _measure_query(self, executor, stage, row_count):
+        creation_script = _creation_script(row_count)
+        query = "SELECT value, label FROM numbers"
+        self._measure(
+            stage,
+            {"rows": row_count},
+            lambda: _check(executor.execute(creation_script, query, timeout=60)),
+        )
+    
+    def _measure_timeout_recovery(self, executor):
+        slow_query = _slow_queries[self._dialect_name]
+        timeout = 0.1
+        
+        def recover():
+            executor.execute([], slow_query, timeout=timeout)
+            _check(executor.execute([], "SELECT 1"))
+        
+        self._measure("timeout_recovery", {"timeout": timeout}, recover)
+    
+    def _measure_concurrency(self, concurrency):
+        creation_script = _creation_script(1000)
+        query_count = concurrency * 4
+        pool = sqlexecutor.executor_pool(
+            self._dialect_name,
+            self._working_dir,
+            size=concurrency,
+            dialect_options=self._dialect_options,
+        )
+        try:
+            def run_queries():
+                pending_results = [
+                    pool.submit(creation_script, "SELECT value, label FROM numbers")
+                    for _ in range(query_count)
+                ]
+                for pending_result in pending_results:
+                    _check(pending_result.result())
+            
+            samples = self._measure("concurrent_queries", {"concurrency": concurrency, "queries": query_count}, run_queries)
+            self._record({
+                "dialect": self._dialect_name,
+                "stage": "throughput",
+                "parameters": {"concurrency": concurrency},
+                "queries_per_second": query_count / _median(samples),
+            })
+        finally:
+            pool.close()
+    
+    def _replay(self, server, creation_script):
+        connection = server.connect()
+        try:
+            cursor = connection.cursor()
+            for statement in creation_script:
+                cursor.execute(statement)
+        finally:
+            connection.close()
+    
+    def _measure(self, stage, parameters, run):
+        # The first run warms up caches and spare processes
+        run()
+        samples = []
+        for _ in range(self._repeat):
+            start = time.time()
+            run()
+            samples.append(time.time() - start)
+        
+        self._record(dict(
+            {"dialect": self._dialect_name, "stage": stage, "parameters": parameters},
+            **_summarise(samples)
+        ))
+        print >> sys.stderr, "{0} {1} {2}: median {3:.6f}s".format(
+            self._dialect_name, stage, json.dumps(parameters, sort_keys=True), _median(samples),
+        )
+        return samples
+
+
+def _creation_script(row_count):
+    statements = ["CREATE TABLE numbers (value INTEGER, label VARCHAR(40))"]
+    for start in range(0, row_count, 1000):
+        values = ", ".join(
+            "({0}, 'Orbiting the Giant Hairball {0}')".format(value)
+            for value in range(start, min(start + 1000, row_count))
+        )
+        statements.append("INSERT INTO numbers (value, label) VALUES {0}".format(values))
+    return statements
+
+
+def _check(result):
+    if result.error is not None:
+        raise Exception(result.error)
+
+
+def _summarise(samples):
+    ordered = sorted(samples)
+    return {
+        "samples": len(ordered),
+        "min": ordered[0],
+        "median": _median(ordered),
+        "p90": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+    }
+
+
+def _median(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) // 2]
+
+
+def _print_comparison(baseline, report):
+    def key(measurement):
+        return (measurement["dialect"], measurement.get("stage"), json.dumps(measurement.get("parameters"), sort_keys=True))
+    
+    baseline_medians = dict(
+        (key(measurement), measurement["median"])
+        for measurement in baseline["measurements"]
+        if "median" in measurement
+    )
+    for measurement in report["measurements"]:
+        baseline_median = baseline_medians.get(key(measurement))
+        if baseline_median is not None and "median" in measurement:
+            print "{0} {1} {2}: {3:.6f}s -> {4:.6f}s ({5:+.1f}%)".format(
+                measurement["dialect"],
+                measurement["stage"],
+                json.dumps(measurement["parameters"], sort_keys=True),
+                baseline_median,
+                measurement["median"],
+                (measurement["median"] / baseline_median - 1) * 100,
+            )
+
+
+if __name__ == "__main__":
+    main()
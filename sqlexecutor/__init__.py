@@ -1,63 +1,230 @@
-__all__ = ["prepare", "executor"]
+__all__ = ["prepare", "executor", "executor_pool", "SnapshotCache", "ResultCache", "Metrics", "DaemonClient"]
 
 
 import sys
 import os
+import re
+import json
+import multiprocessing
 import sqlite3
+import select
+import collections
+import importlib
+import shutil
 import subprocess
 import threading
 import time
 
-import msgpack
+from .results import ResultTable, Result, QueryPlan, ColumnBuilder, deserialise_result, timeout_error as _timeout_error
+from . import protocol
+from .pool import ExecutorPool, PendingResultTimeout
+from .snapshots import SnapshotCache, NoSnapshot, script_key
+from .scripts import ScriptCache, PreparedScript
+from .resultcache import ResultCache, CachingQueryExecutor
+from .tempdir import create_temporary_dir
+from .timings import Timings, Metrics
+from .daemon import DaemonClient, DaemonError
+from .limits import limit_worker, memory_error as _memory_error, cpu_error as _cpu_error, worker_exited_error as _worker_exited_error
 
-from .mysqlexecutor import MySqlDialect
-from .results import ResultTable, Result
 
+_default_chunk_size = 1000
 
-def prepare(name, working_dir):
-    dialect = _get_dialect(name, working_dir)
+
+def prepare(name, working_dir, **dialect_options):
+    dialect = _get_dialect(name, working_dir, **dialect_options)
     dialect.prepare()
     
 
-def executor(name, working_dir):
-    dialect = _get_dialect(name, working_dir)
+def executor(name, working_dir, snapshot_cache=None, max_rows=None, max_result_bytes=None,
+        result_cache=None, metrics=None, preprocess_scripts=True, coalesce_inserts=False, **dialect_options):
+    dialect = _get_dialect(name, working_dir, **dialect_options)
     server = dialect.start_server()
-    return QueryExecutor(dialect, server)
+    query_executor = QueryExecutor(
+        dialect,
+        server,
+        snapshot_cache=snapshot_cache,
+        max_rows=max_rows,
+        max_result_bytes=max_result_bytes,
+        metrics=metrics,
+        script_cache=ScriptCache(coalesce=coalesce_inserts) if preprocess_scripts else None,
+    )
+    return _with_result_cache(query_executor, result_cache, name, {
+        "max_rows": max_rows,
+        "max_result_bytes": max_result_bytes,
+        "coalesce_inserts": coalesce_inserts,
+        "dialect_options": dialect_options,
+    })
+
+
+def subprocess_executor(name, working_dir, result_cache=None, **options):
+    return _with_result_cache(
+        RestartingSubprocessQueryExecutor(name, working_dir, **options),
+        result_cache,
+        name,
+        {
+            "max_rows": options.get("max_rows"),
+            "max_result_bytes": options.get("max_result_bytes"),
+            "coalesce_inserts": options.get("coalesce_inserts", False),
+            "dialect_options": options.get("dialect_options") or {},
+            "resource_limits": options.get("resource_limits") or {},
+        },
+    )
+
 
+def executor_pool(name, working_dir, size=None, dispatch="least_loaded", result_cache=None, **options):
+    if size is None:
+        size = multiprocessing.cpu_count()
+    # The result cache is shared by all of the workers
+    return ExecutorPool(
+        lambda: subprocess_executor(name, working_dir, result_cache=result_cache, **options),
+        size=size,
+        dispatch=dispatch,
+    )
 
-def subprocess_executor(name, working_dir):
-    return RestartingSubprocessQueryExecutor(name, working_dir)
 
+def _with_result_cache(query_executor, result_cache, name, options):
+    if result_cache is None:
+        return query_executor
+    else:
+        # Results depend on the limits and dialect options, such as
+        # cpu_seconds and session_variables, as well as on the queries, so
+        # executors with different options can share a cache safely
+        options = dict(options)
+        options.setdefault("resource_limits", {})
+        namespace = json.dumps([name, options], sort_keys=True)
+        return CachingQueryExecutor(query_executor, result_cache, namespace)
 
-def _get_dialect(name, working_dir):
+
+def _get_dialect(name, working_dir, **dialect_options):
     if working_dir is not None:
         working_dir = os.path.join(working_dir, name)
-    return _dialects[name](working_dir)
+    return _dialect_class(name)(working_dir, **dialect_options)
+
+
+def _dialect_class(name):
+    # Dialects are only imported when they're first used, so that using
+    # sqlite3 doesn't wait for MySQLdb and spur to be imported, and so
+    # that worker processes start quickly
+    dialect = _dialects[name]
+    if isinstance(dialect, basestring):
+        module_name, class_name = dialect.split(":")
+        dialect = getattr(importlib.import_module(module_name, __name__), class_name)
+        _dialects[name] = dialect
+    return dialect
 
 
 class RestartingSubprocessQueryExecutor(object):
-    def __init__(self, dialect_name, working_dir):
+    def __init__(self, dialect_name, working_dir, timeout=2,
+            compression_threshold=protocol.DEFAULT_COMPRESSION_THRESHOLD,
+            max_rows=None, max_result_bytes=None, spares=0, snapshot_cache=None,
+            dialect_options=None, metrics=None, resource_limits=None, preprocess_scripts=True,
+            coalesce_inserts=False):
         self._dialect_name = dialect_name
         self._working_dir = working_dir
+        self._timeout = timeout
+        self._compression_threshold = compression_threshold
+        # Sent to process.py as JSON, so snapshot_cache is a dict of
+        # arguments for SnapshotCache rather than the cache itself
+        self._executor_options = dict(dialect_options or {})
+        self._executor_options.update({
+            "max_rows": max_rows,
+            "max_result_bytes": max_result_bytes,
+            "snapshot_cache": snapshot_cache,
+            "preprocess_scripts": preprocess_scripts,
+            "coalesce_inserts": coalesce_inserts,
+        })
+        self._metrics = metrics
+        # A dict that may contain address_space (in bytes) and cpu_seconds
+        # (for each query)
+        self._resource_limits = dict(resource_limits or {})
         self._executor = None
+        self._has_started = False
+        self._spares = None if spares == 0 else _Spares(self._spawn_executor, spares)
         
-    def execute(self, creation_sql, query):
-        self._start_executor()
+    def execute(self, creation_sql, query, timeout=None, stream=False, chunk_size=_default_chunk_size, explain=False):
+        timings = Timings()
+        self._start(timings)
         try:
-            return self._executor.execute(creation_sql, query)
+            result = self._executor.execute(
+                creation_sql,
+                query,
+                timeout=timeout,
+                stream=stream,
+                chunk_size=chunk_size,
+                explain=explain,
+            )
         except QueryTimeoutException:
-            self._executor.close()
-            self._executor = None
-            return Result(query=query, error="The query took too long to finish", table=None)
+            self._discard_executor()
+            result = Result(query=query, error=_timeout_error, table=None)
+        except ExecutorExitedException:
+            self._discard_executor()
+            result = Result(query=query, error=_worker_exited_error, table=None)
+        
+        self._record(result, timings)
+        return result
+    
+    def execute_many(self, creation_sql, queries, timeout=None):
+        timings = Timings()
+        self._start(timings)
+        try:
+            results = self._executor.execute_many(creation_sql, queries, timeout=timeout)
+        except QueryTimeoutException:
+            self._discard_executor()
+            results = [
+                Result(query=query, error=_timeout_error, table=None)
+                for query in queries
+            ]
+        except ExecutorExitedException:
+            self._discard_executor()
+            results = [
+                Result(query=query, error=_worker_exited_error, table=None)
+                for query in queries
+            ]
+        
+        for result in results:
+            self._record(result, timings)
+            timings = Timings()
+        return results
     
     def close(self):
+        if self._spares is not None:
+            self._spares.close()
         if self._executor is not None:
             self._executor.close()
         
-    def _start_executor(self):
+    def start(self):
+        self._start(Timings())
+    
+    def _start(self, timings):
         if self._executor is not None:
-            return
+            if self._executor.is_broken():
+                # A streamed result timed out while being read, or the
+                # worker exited while it was being read
+                self._executor.close()
+                self._executor = None
+            else:
+                return
+        
+        with timings.stage("start"):
+            if self._spares is None:
+                self._executor = self._spawn_executor()
+            else:
+                self._executor = self._spares.take()
         
+        if self._has_started and self._metrics is not None:
+            self._metrics.record_restart()
+        self._has_started = True
+    
+    def _record(self, result, timings):
+        result.timings.update(timings.stages)
+        if self._metrics is not None:
+            self._metrics.record(result)
+    
+    def _discard_executor(self):
+        self._executor.close()
+        self._executor = None
+    
+    def _spawn_executor(self):
         script_path = os.path.join(os.path.dirname(__file__), "process.py")
         
         process = subprocess.Popen(
@@ -66,45 +233,179 @@ class RestartingSubprocessQueryExecutor(object):
                 script_path,
                 self._dialect_name,
                 os.path.abspath(self._working_dir),
+                json.dumps({
+                    "compression_threshold": self._compression_threshold,
+                    "executor": self._executor_options,
+                    "cpu_seconds": self._resource_limits.get("cpu_seconds"),
+                }),
             ],
             
             stdout=subprocess.PIPE,
             stderr=sys.stderr,
             stdin=subprocess.PIPE,
             
-            # Create a new process group
-            preexec_fn=os.setpgrp,
+            # Create a new process group, and apply resource limits
+            preexec_fn=lambda: limit_worker(self._resource_limits),
         )
         try:
-            line = process.stdout.readline()
-            if line != "Ready\n":
-                raise Exception("Could not start executor" + line)
-            
-            self._executor = SubprocessQueryExecutor(process)
+            executor = SubprocessQueryExecutor(
+                process,
+                timeout=self._timeout,
+                compression_threshold=self._compression_threshold,
+            )
+            executor.wait_until_ready()
+            return executor
         except:
             process.terminate()
             raise
 
 
+class _Spares(object):
+    # Keeps workers booted and ready in the background so that a worker that
+    # has been killed can be replaced without waiting for a new process
+    # (and, for MySQL, a new server) to start
+    
+    _retry_interval = 1
+    
+    def __init__(self, spawn, count):
+        self._spawn = spawn
+        self._count = count
+        self._ready = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def take(self):
+        with self._condition:
+            if self._ready:
+                executor = self._ready.popleft()
+                self._condition.notify()
+                return executor
+        
+        return self._spawn()
+    
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        for executor in self._ready:
+            executor.close()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and len(self._ready) >= self._count:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            
+            try:
+                executor = self._spawn()
+            except Exception:
+                # take() will try to spawn a worker itself if there are no
+                # spares, and will report the error if that fails too
+                with self._condition:
+                    if not self._closed:
+                        self._condition.wait(self._retry_interval)
+                continue
+            
+            with self._condition:
+                if self._closed:
+                    executor.close()
+                    return
+                self._ready.append(executor)
+
+
 class SubprocessQueryExecutor(object):
-    def __init__(self, process):
+    _startup_timeout = 60
+    
+    # The worker cancels queries that run past their timeout itself. We
+    # only give up on the worker if it hasn't replied by the end of this
+    # grace period.
+    _cancellation_grace_period = 1
+    
+    def __init__(self, process, timeout=2,
+            compression_threshold=protocol.DEFAULT_COMPRESSION_THRESHOLD):
         self._process = process
-        self._receiver = msgpack.Unpacker(self._process.stdout, read_size=1)
+        self._timeout = timeout
+        self._compression_threshold = compression_threshold
+        self._stdout_fd = process.stdout.fileno()
+        self._poll = select.poll()
+        self._poll.register(self._stdout_fd, select.POLLIN)
+        self._receiver = protocol.FrameReader()
+        self._broken = False
+        self._stream = None
+    
+    def wait_until_ready(self):
+        try:
+            message = self._receive(self._startup_timeout)
+        except QueryTimeoutException:
+            raise Exception("Could not start executor: timed out")
+        except ExecutorExitedException:
+            raise Exception("Could not start executor: exited")
+        
+        if message != ["ready", protocol.VERSION]:
+            raise Exception("Could not start executor: unexpected handshake {0!r}".format(message))
         
-    def execute(self, creation_sql, query):
-        self._send_command("execute", creation_sql, query)
-        (error, column_names, rows) = self._receive()
+    def execute(self, creation_sql, query, timeout=None, stream=False, chunk_size=_default_chunk_size, explain=False):
+        if stream and explain:
+            raise ValueError("Query plans can't be captured for streamed results")
+        if timeout is None:
+            timeout = self._timeout
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
         
-        if column_names is None:
-            table = None
+        reply_timeout = timeout + self._cancellation_grace_period
+        
+        start = time.time()
+        if stream:
+            self._send_command("execute_streaming", creation_sql, query, chunk_size, timeout)
+            (error, column_names, timings) = self._receive(reply_timeout)
+            if column_names is None:
+                table = None
+            else:
+                self._stream = _SubprocessChunks(self, timeout)
+                table = ResultTable(column_names, chunks=self._stream)
+            
+            results = [Result(
+                query=query,
+                error=error,
+                table=table,
+                timings=timings,
+            )]
         else:
-            table = ResultTable(column_names, rows)
+            self._send_command("execute", creation_sql, query, timeout, explain)
+            results = [deserialise_result(query, self._receive(reply_timeout))]
         
-        return Result(
-            query=query,
-            error=error,
-            table=table
-        )
+        _add_transport_time(results, time.time() - start)
+        return results[0]
+    
+    def execute_many(self, creation_sql, queries, timeout=None):
+        if timeout is None:
+            timeout = self._timeout
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        
+        # Each query gets its own timeout, so the whole batch may take as long
+        # as all of them put together
+        reply_timeout = timeout * len(queries) + self._cancellation_grace_period
+        start = time.time()
+        self._send_command("execute_many", creation_sql, queries, timeout)
+        results = [
+            deserialise_result(query, serialised)
+            for query, serialised in zip(queries, self._receive(reply_timeout))
+        ]
+        _add_transport_time(results, time.time() - start)
+        return results
+        
+    def is_broken(self):
+        return self._broken
         
     def close(self):
         subprocess.check_call(["kill", "--", "-{0}".format(self._process.pid)])
@@ -117,105 +418,774 @@ class SubprocessQueryExecutor(object):
         thread.start()
         
     def _send_command(self, *args):
-        msgpack.dump(args, self._process.stdin)
-        self._process.stdin.flush()
+        protocol.write_message(
+            self._process.stdin,
+            args,
+            compression_threshold=self._compression_threshold,
+        )
         
-    def _receive(self):
-        result = [None]
+    def _receive(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            for message in self._receiver.messages():
+                return message
+            
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self._poll.poll(remaining * 1000):
+                self._broken = True
+                raise QueryTimeoutException()
+            
+            data = os.read(self._stdout_fd, protocol.READ_SIZE)
+            if not data:
+                self._broken = True
+                raise ExecutorExitedException("Executor exited unexpectedly")
+            self._receiver.feed(data)
+
+
+def _add_transport_time(results, elapsed):
+    # Whatever time the worker didn't spend on the queries themselves went
+    # on sending commands and results between the processes
+    if results:
+        worker_time = sum(sum(result.timings.itervalues()) for result in results)
+        transport_time = max(0, elapsed - worker_time) / len(results)
+        for result in results:
+            result.timings["transport"] = transport_time
+
+
+class _SubprocessChunks(object):
+    # Chunks are requested one at a time so that the worker stops fetching
+    # rows as soon as the caller stops reading them
+    
+    def __init__(self, executor, timeout):
+        self._executor = executor
+        self._timeout = timeout
+        self._finished = False
+        self.truncated = False
+        self.row_count = 0
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        if self._finished:
+            raise StopIteration()
         
-        def run():
-            try:
-                result[0] = next(self._receiver)
-            except StopIteration:
-                result[0] = None
+        self._executor._send_command("next")
+        try:
+            message = self._executor._receive(self._timeout)
+        except:
+            self._finished = True
+            raise
         
-        thread = threading.Thread(target=run)
-        thread.start()
-        thread.join(2)
-        if thread.isAlive():
-            raise QueryTimeoutException()
+        if message[0] == "end":
+            self._finished = True
+            self.truncated = message[1]
+            raise StopIteration()
         else:
-            return result[0]
+            self.row_count += len(message[1])
+            return message[1]
+    
+    def close(self):
+        if not self._finished:
+            self._finished = True
+            self._executor._send_command("stop")
 
 
 class QueryTimeoutException(Exception):
     pass
+
+
+class ExecutorExitedException(Exception):
+    pass
     
 
 class QueryExecutor(object):
-    def __init__(self, dialect, server):
+    def __init__(self, dialect, server, snapshot_cache=None, max_rows=None, max_result_bytes=None, metrics=None,
+            script_cache=None):
         self._dialect = dialect
         self._server = server
+        self._snapshot_cache = snapshot_cache
+        self._script_cache = script_cache
+        self._max_rows = max_rows
+        self._max_result_bytes = max_result_bytes
+        self._metrics = metrics
+        self._watchdog = None
         
-    def execute(self, creation_script, query):
+    def execute(self, creation_script, query, stream=False, chunk_size=_default_chunk_size, timeout=None, explain=False):
+        timings = Timings()
+        script = self._prepare_script(creation_script)
+        result = self._execute(
+            lambda: self._connect(script, timings),
+            query,
+            timings,
+            stream=stream,
+            chunk_size=chunk_size,
+            timeout=timeout,
+            explain=explain,
+        )
+        self._record(result)
+        return result
+    
+    def execute_many(self, creation_script, queries, timeout=None):
+        if self._snapshot_cache is not None or not queries:
+            return [
+                self.execute(creation_script, query, timeout=timeout)
+                for query in queries
+            ]
+        
+        # Without a cache, the script would otherwise be replayed once per
+        # query, so snapshot it just for the length of the batch instead.
+        # The time taken is included in the timings of the first query.
+        script = self._prepare_script(creation_script)
+        batch_timings = Timings()
+        with batch_timings.stage("snapshot"):
+            snapshot = self._server.create_snapshot(script.statements)
+        try:
+            results = []
+            for query in queries:
+                timings = batch_timings
+                batch_timings = Timings()
+                result = self._execute(
+                    lambda: self._connect_to(snapshot, script, timings),
+                    query,
+                    timings,
+                    timeout=timeout,
+                )
+                self._record(result)
+                results.append(result)
+            return results
+        finally:
+            snapshot.close()
+    
+    def _record(self, result):
+        if self._metrics is not None:
+            self._metrics.record(result)
+    
+    def _execute(self, connect, query, timings, stream=False, chunk_size=_default_chunk_size, timeout=None, explain=False):
+        if stream and explain:
+            raise ValueError("Query plans can't be captured for streamed results")
         if not query:
             return Result(query=query, error="Query is empty", table=None)
             
-        connection = self._server.connect()
+        connection = connect()
+        if timeout is not None:
+            if self._watchdog is None:
+                self._watchdog = _Watchdog()
+            self._watchdog.start(timeout, connection.cancel)
+        plan = None
         try:
-            cursor = connection.cursor()
-            for statement in creation_script:
-                cursor.execute(statement)
+            if explain:
+                with timings.stage("plan"):
+                    plan = self._start_plan(connection, query)
             
+            has_limits = self._max_rows is not None or self._max_result_bytes is not None
+            if stream or has_limits:
+                cursor = connection.streaming_cursor()
+            else:
+                cursor = connection.cursor()
             try:
-                cursor.execute(query)
+                with timings.stage("query"):
+                    cursor.execute(query)
+            except MemoryError:
+                return Result(query=query, error=_memory_error, table=None, timings=timings.stages, plan=plan)
             except self._dialect.DatabaseError as error:
+                if self._was_cancelled():
+                    return Result(query=query, error=_timeout_error, table=None, timings=timings.stages, plan=plan)
                 error_message = connection.error_message(error)
-                return Result(query=query, error=error_message, table=None)
+                return Result(query=query, error=error_message, table=None, timings=timings.stages, plan=plan)
             
             column_names = [
                 column[0]
                 for column in cursor.description
             ]
             
-            rows = map(list, cursor.fetchall())
+            chunks = _CursorChunks(
+                cursor,
+                connection,
+                chunk_size,
+                max_rows=self._max_rows,
+                max_result_bytes=self._max_result_bytes,
+                rows_as_lists=stream,
+                before_close=None if plan is None else lambda connection=connection: self._finish_plan(connection, plan),
+            )
+            # The connection is now closed once the rows have been read
+            connection = None
             
-            table = ResultTable(column_names, rows)
+            if stream:
+                table = ResultTable(column_names, chunks=chunks)
+            else:
+                columns = ColumnBuilder(len(column_names))
+                try:
+                    with timings.stage("fetch"):
+                        for chunk in chunks:
+                            columns.add_rows(chunk)
+                except MemoryError:
+                    chunks.close()
+                    return Result(query=query, error=_memory_error, table=None, timings=timings.stages, plan=plan)
+                except self._dialect.DatabaseError:
+                    if self._was_cancelled():
+                        return Result(query=query, error=_timeout_error, table=None, timings=timings.stages, plan=plan)
+                    raise
+                table = ResultTable(
+                    column_names,
+                    columns=columns.build(),
+                    row_count=chunks.row_count,
+                    truncated=chunks.truncated,
+                )
             
             return Result(
                 query=query,
                 error=None,
                 table=table,
+                timings=timings.stages,
+                plan=plan,
             )
         finally:
-            connection.close()
+            if timeout is not None:
+                self._watchdog.stop()
+            if connection is not None:
+                connection.close()
             
     def close(self):
-        self._server.close()
+        try:
+            if self._watchdog is not None:
+                self._watchdog.close()
+            if self._snapshot_cache is not None:
+                self._snapshot_cache.close()
+        finally:
+            self._server.close()
+    
+    def _start_plan(self, connection, query):
+        try:
+            plan = connection.explain(query)
+        except self._dialect.DatabaseError:
+            # Not every statement can be explained, but what the server
+            # reports about running it is still worth having
+            plan = QueryPlan(None, None)
+        connection.start_statistics()
+        return plan
+    
+    def _finish_plan(self, connection, plan):
+        try:
+            connection.finish_statistics(plan)
+        except self._dialect.DatabaseError:
+            pass
+    
+    def _was_cancelled(self):
+        return self._watchdog is not None and self._watchdog.has_fired()
+    
+    def _prepare_script(self, creation_script):
+        # Preparing fingerprints the script, and may combine single row
+        # inserts so that fewer statements are sent to the server
+        if self._script_cache is None:
+            return PreparedScript(creation_script, script_key(creation_script))
+        else:
+            return self._script_cache.prepare(creation_script)
+    
+    def _connect(self, script, timings):
+        return self._connect_to(self._snapshot(script, timings), script, timings)
+    
+    def _connect_to(self, snapshot, script, timings):
+        if snapshot is not None and not isinstance(snapshot, NoSnapshot):
+            return self._server.connect(snapshot=snapshot, timings=timings)
+        
+        connection = self._server.connect(timings=timings, creation_script=script.statements)
+        try:
+            with timings.stage("creation_script"):
+                cursor = connection.cursor()
+                for statement in script.statements:
+                    cursor.execute(statement)
+            return connection
+        except:
+            connection.close()
+            raise
+    
+    def _snapshot(self, script, timings):
+        if self._snapshot_cache is None:
+            return None
+        
+        snapshot = self._snapshot_cache.get(script.key)
+        if snapshot is None:
+            with timings.stage("snapshot"):
+                snapshot = self._server.create_snapshot(script.statements)
+            self._snapshot_cache.add(script.key, snapshot)
+        
+        if isinstance(snapshot, NoSnapshot):
+            return None
+        else:
+            return snapshot
+
+
+class _Watchdog(object):
+    # Cancels the running query once its deadline has passed. A single
+    # thread is shared by all queries on an executor.
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._deadline = None
+        self._cancel = None
+        self._fired = False
+        self._closed = False
+        
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def start(self, timeout, cancel):
+        with self._condition:
+            self._deadline = time.time() + timeout
+            self._cancel = cancel
+            self._fired = False
+            self._condition.notify()
+    
+    def stop(self):
+        with self._condition:
+            self._deadline = None
+            self._cancel = None
+    
+    def has_fired(self):
+        with self._condition:
+            return self._fired
+    
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and self._deadline is None:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                
+                remaining = self._deadline - time.time()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                
+                cancel = self._cancel
+                self._deadline = None
+                self._cancel = None
+                self._fired = True
+                
+                # Cancelling while holding the condition means that stop()
+                # waits for it to finish. Connections are reused, so a
+                # late cancel could otherwise stop the next query.
+                try:
+                    cancel()
+                except Exception:
+                    # If the query can't be cancelled, then the parent process
+                    # will give up waiting and restart the worker
+                    pass
+
+
+class _CursorChunks(object):
+    def __init__(self, cursor, connection, chunk_size, max_rows=None, max_result_bytes=None, rows_as_lists=True,
+            before_close=None):
+        self._cursor = cursor
+        self._connection = connection
+        # Called once every row has been read, while the connection can
+        # still run other statements
+        self._before_close = before_close
+        self._has_read_all_rows = False
+        self._chunk_size = chunk_size
+        self._max_rows = max_rows
+        self._max_result_bytes = max_result_bytes
+        # Rows that are only going to be turned into columns are left as the
+        # tuples that the cursor returned
+        self._rows_as_lists = rows_as_lists
+        self._byte_count = 0
+        self.truncated = False
+        self.row_count = 0
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        if self._connection is None:
+            raise StopIteration()
+        
+        try:
+            rows = self._fetch()
+        except:
+            self.close()
+            raise
+        
+        if rows:
+            return rows
+        else:
+            self._has_read_all_rows = not self.truncated
+            self.close()
+            raise StopIteration()
+    
+    def close(self):
+        if self._connection is not None:
+            try:
+                # Reading the rest of a truncated result so that the
+                # connection can run something else would defeat the limits
+                if self._before_close is not None and self._has_read_all_rows:
+                    self._cursor.close()
+                    self._before_close()
+            finally:
+                self._connection.close()
+                self._connection = None
+    
+    def _fetch(self):
+        if self.truncated:
+            return []
+        
+        fetch_size = self._chunk_size
+        if self._max_rows is not None:
+            fetch_size = min(fetch_size, self._max_rows - self.row_count)
+            if fetch_size <= 0:
+                self.truncated = self._cursor.fetchone() is not None
+                return []
+        
+        rows = []
+        for row in self._cursor.fetchmany(fetch_size):
+            if self._max_result_bytes is not None:
+                self._byte_count += _estimate_row_size(row)
+                if self._byte_count > self._max_result_bytes:
+                    self.truncated = True
+                    break
+            rows.append(list(row) if self._rows_as_lists else row)
+        
+        self.row_count += len(rows)
+        return rows
+
+
+def _estimate_row_size(row):
+    return sum(
+        len(value) if isinstance(value, (basestring, buffer, bytearray)) else 8
+        for value in row
+    )
 
 
 class Sqlite3Dialect(object):
     DatabaseError = sqlite3.Error
     
-    def __init__(self, working_dir):
-        pass
+    def __init__(self, working_dir, idle_connections=8, cache_size=None, heap_limit=None, cpu_seconds=None):
+        self._idle_connections = idle_connections
+        self._cache_size = cache_size
+        self._heap_limit = heap_limit
+        self._cpu_seconds = cpu_seconds
     
     def start_server(self):
-        return Sqlite3Server()
+        return Sqlite3Server(
+            idle_connections=self._idle_connections,
+            cache_size=self._cache_size,
+            heap_limit=self._heap_limit,
+            cpu_seconds=self._cpu_seconds,
+        )
         
     def prepare(self):
         pass
 
 
 class Sqlite3Server(object):
-    def connect(self):
-        return Sqlite3Connection(sqlite3.connect(":memory:"))
+    # Each connection runs inside a transaction. When the connection is
+    # closed, rolling back that transaction puts the database back to how
+    # it was, so the connection can be handed out again for the same
+    # snapshot rather than copying the snapshot and connecting again.
+    
+    def __init__(self, idle_connections=8, cache_size=None, heap_limit=None, cpu_seconds=None):
+        self._temp_dir = None
+        self._idle = _IdleConnections(idle_connections)
+        # Sizes are in bytes
+        self._cache_size = cache_size
+        self._cpu_seconds = cpu_seconds
+        if heap_limit is not None:
+            # The heap limit applies to every connection in the process.
+            # Versions of sqlite without it ignore the pragma.
+            connection = sqlite3.connect(":memory:")
+            try:
+                connection.execute("PRAGMA hard_heap_limit = {0}".format(int(heap_limit)))
+            finally:
+                connection.close()
+    
+    def connect(self, snapshot=None, timings=None, creation_script=None):
+        # creation_script is the script that's about to be replayed on the
+        # connection, if any
+        if timings is None:
+            timings = Timings()
+        
+        if creation_script is not None and _changes_connection_state(creation_script):
+            # Some pragmas, such as foreign_keys, do nothing inside a
+            # transaction, so the script gets a connection of its own that
+            # isn't in one and isn't reused
+            with timings.stage("provision"):
+                return self._open(None, ":memory:", reusable=False)
+        
+        key = None if snapshot is None else snapshot.path
+        connection = self._idle.take(key)
+        if connection is not None:
+            connection.start_cpu_budget()
+            return connection
+        
+        if snapshot is None:
+            with timings.stage("provision"):
+                return self._open(key, ":memory:")
+        
+        path = self._new_database_path()
+        try:
+            with timings.stage("restore"):
+                shutil.copyfile(snapshot.path, path)
+                return self._open(key, path)
+        except:
+            _remove_if_exists(path)
+            raise
+    
+    def _open(self, key, path, reusable=True):
+        # Connections may be reused by a different thread from the one that
+        # opened them, but are never used by two threads at once
+        if reusable:
+            on_close = lambda connection: self._release(key, connection)
+        else:
+            on_close = None
+        connection = Sqlite3Connection(
+            sqlite3.connect(path, isolation_level=None, check_same_thread=False),
+            path=None if path == ":memory:" else path,
+            on_close=on_close,
+            cpu_seconds=self._cpu_seconds,
+        )
+        if self._cache_size is not None:
+            # Set before the connection's transaction begins so that it
+            # doesn't stop the connection from being reused
+            connection.cursor().execute("PRAGMA cache_size = {0}".format(-int(self._cache_size) // 1024))
+        if reusable:
+            connection.begin()
+        connection.start_cpu_budget()
+        return connection
+    
+    def _release(self, key, connection):
+        try:
+            reusable = connection.reset()
+        except sqlite3.Error:
+            reusable = False
+        
+        if reusable:
+            for evicted in self._idle.give_back(key, connection):
+                evicted.really_close()
+        else:
+            connection.really_close()
+    
+    def create_snapshot(self, creation_script):
+        # Pragmas such as foreign_keys belong to the connection rather than
+        # to the database file, so copying the file wouldn't reproduce them
+        if _changes_connection_state(creation_script):
+            return NoSnapshot()
+        
+        path = self._new_database_path()
+        try:
+            connection = sqlite3.connect(path)
+            try:
+                cursor = connection.cursor()
+                for statement in creation_script:
+                    cursor.execute(statement)
+                connection.commit()
+                cursor.execute("SELECT COUNT(*) FROM sqlite_temp_master")
+                (temporary_object_count, ) = cursor.fetchone()
+            finally:
+                connection.close()
+        except:
+            _remove_if_exists(path)
+            raise
+        
+        # Temporary objects aren't written to the database file, so
+        # copying the file wouldn't reproduce them
+        if temporary_object_count:
+            os.remove(path)
+            return NoSnapshot()
+        else:
+            return Sqlite3Snapshot(path)
         
     def close(self):
-        pass
+        for connection in self._idle.close():
+            connection.really_close()
+        if self._temp_dir is not None:
+            self._temp_dir.close()
+    
+    def _new_database_path(self):
+        if self._temp_dir is None:
+            self._temp_dir = create_temporary_dir()
+        return os.path.join(self._temp_dir.path, os.urandom(16).encode("hex"))
+
+
+class Sqlite3Snapshot(object):
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+    
+    def close(self):
+        os.remove(self.path)
+
+
+class _IdleConnections(object):
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._size = 0
+        self._connections = collections.OrderedDict()
+    
+    def take(self, key):
+        connections = self._connections.get(key)
+        if not connections:
+            return None
+        
+        connection = connections.pop()
+        self._size -= 1
+        if not connections:
+            del self._connections[key]
+        return connection
+    
+    def give_back(self, key, connection):
+        connections = self._connections.pop(key, [])
+        connections.append(connection)
+        self._connections[key] = connections
+        self._size += 1
+        
+        evicted = []
+        while self._size > self._max_size:
+            oldest_key, oldest = next(self._connections.iteritems())
+            evicted.append(oldest.pop(0))
+            self._size -= 1
+            if not oldest:
+                del self._connections[oldest_key]
+        return evicted
+    
+    def close(self):
+        connections = [
+            connection
+            for key_connections in self._connections.itervalues()
+            for connection in key_connections
+        ]
+        self._connections.clear()
+        self._size = 0
+        return connections
 
 
 class Sqlite3Connection(object):
-    def __init__(self, connection):
-        self.close = connection.close
+    # sqlite calls the progress handler after this many virtual machine
+    # instructions
+    _progress_interval = 10000
+    
+    def __init__(self, connection, path=None, on_close=None, cpu_seconds=None):
+        self._connection = connection
+        self._path = path
+        self._on_close = on_close
+        self._reusable = True
+        self._is_resetting = False
+        self._cpu_seconds = cpu_seconds
+        self._cpu_deadline = None
+        self._cpu_exceeded = False
+        self._statistics_start = None
         self.cursor = connection.cursor
+        # sqlite3 cursors already step through rows as they're fetched
+        self.streaming_cursor = connection.cursor
+        self.cancel = connection.interrupt
+        if cpu_seconds is not None:
+            connection.set_progress_handler(self._check_cpu_time, self._progress_interval)
+    
+    def start_cpu_budget(self):
+        # The budget covers everything run on the connection until it's
+        # closed, including the creation script if there's no snapshot.
+        # time.clock() is the CPU time of the whole process, so this is only
+        # accurate when one query runs at a time, as in a worker process.
+        if self._cpu_seconds is not None:
+            self._cpu_deadline = time.clock() + self._cpu_seconds
+            self._cpu_exceeded = False
+    
+    def begin(self):
+        self._connection.set_authorizer(self._authorize)
+        self._run_own_statement("BEGIN")
+        self._reusable = True
+    
+    def reset(self):
+        # Returns whether the connection can be used again
+        if not self._reusable:
+            return False
+        self._cpu_deadline = None
+        self._run_own_statement("ROLLBACK")
+        self._run_own_statement("BEGIN")
+        return True
+    
+    def close(self):
+        if self._on_close is None:
+            self.really_close()
+        else:
+            self._on_close(self)
+    
+    def really_close(self):
+        self._connection.close()
+        if self._path is not None:
+            os.remove(self._path)
+    
+    def _run_own_statement(self, statement):
+        self._is_resetting = True
+        try:
+            self._connection.execute(statement)
+        finally:
+            self._is_resetting = False
+    
+    def explain(self, query):
+        cursor = self._connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + query)
+        return QueryPlan([column[0] for column in cursor.description], map(list, cursor.fetchall()))
+    
+    def start_statistics(self):
+        self._statistics_start = time.time()
+    
+    def finish_statistics(self, plan):
+        # sqlite runs in this process, so the time spent executing the
+        # query and fetching its rows is the time spent by the server.
+        # Python's sqlite3 module doesn't expose the statement counters
+        # that would give the rows examined.
+        plan.server_seconds = time.time() - self._statistics_start
+    
+    def _check_cpu_time(self):
+        # Returning a true value aborts the statement
+        if self._cpu_deadline is not None and time.clock() > self._cpu_deadline:
+            self._cpu_exceeded = True
+            return 1
+        return 0
+    
+    def _authorize(self, action, *args):
+        # Rolling back can't undo ending our transaction, attaching other
+        # databases or changing pragmas
+        if action in _unresettable_actions and not self._is_resetting:
+            self._reusable = False
+        return sqlite3.SQLITE_OK
     
     def error_message(self, error):
+        if self._cpu_exceeded:
+            return _cpu_error
         return error.message
 
 
+_unresettable_actions = set([
+    sqlite3.SQLITE_TRANSACTION,
+    sqlite3.SQLITE_ATTACH,
+    sqlite3.SQLITE_DETACH,
+    sqlite3.SQLITE_PRAGMA,
+])
+
+
+_pragma_regex = re.compile(r"\bPRAGMA\b", re.IGNORECASE)
+
+
+def _changes_connection_state(creation_script):
+    return any(_pragma_regex.search(statement) for statement in creation_script)
+
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
 _dialects = {
     "sqlite3": Sqlite3Dialect,
-    "mysql": MySqlDialect,
+    "mysql": ".mysqlexecutor:MySqlDialect",
 }
     
@@ -0,0 +1,295 @@
+import itertools
+import os
+import signal
+import socket
+import sys
+import threading
+
+from . import protocol
+from .pool import PendingResult
+from .results import serialise_result, deserialise_result
+
+
+# Requests are ("execute", request_id, creation_sql, query) or
+# ("execute_many", request_id, creation_sql, queries). Each response is
+# (request_id, error, result), where error is only set if the request
+# couldn't be run at all. Responses are sent as soon as each request
+# finishes, so they may arrive in a different order to the requests.
+
+
+def main():
+    # Imported here rather than at the top so that importing sqlexecutor
+    # for its client doesn't slow down the start of worker processes
+    import argparse
+    import sqlexecutor
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dialect")
+    parser.add_argument("working_dir")
+    parser.add_argument("socket_path")
+    parser.add_argument("--size", type=int)
+    parser.add_argument("--dispatch", default="least_loaded")
+    parser.add_argument("--timeout", type=float, default=2)
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    args = parser.parse_args()
+    
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    pool = sqlexecutor.executor_pool(
+        args.dialect,
+        args.working_dir,
+        size=args.size,
+        dispatch=args.dispatch,
+        timeout=args.timeout,
+    )
+    try:
+        daemon = Daemon(args.socket_path, pool, max_in_flight=args.max_in_flight)
+        try:
+            daemon.serve_forever()
+        finally:
+            daemon.close()
+    finally:
+        pool.close()
+
+
+class Daemon(object):
+    def __init__(self, socket_path, pool, max_in_flight=64):
+        self._socket_path = socket_path
+        self._pool = pool
+        self._max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._closed = False
+        
+        # A socket left behind by a daemon that didn't shut down cleanly
+        # would stop us from binding
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(socket_path)
+        self._socket.listen(128)
+    
+    def serve_forever(self):
+        while True:
+            try:
+                client_socket, _ = self._socket.accept()
+            except socket.error:
+                if self._closed:
+                    return
+                raise
+            
+            connection = _Connection(client_socket, self._pool, self._max_in_flight, self._forget)
+            with self._lock:
+                self._connections.add(connection)
+            connection.start()
+    
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            connections = list(self._connections)
+        
+        # Shutting the socket down wakes up any thread waiting in accept()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+        for connection in connections:
+            connection.close()
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+    
+    def _forget(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+
+class _Connection(object):
+    # Each client can have up to max_in_flight requests running at once.
+    # Beyond that, we stop reading from the socket, so a client that sends
+    # requests faster than they can be run is blocked when sending.
+    
+    def __init__(self, client_socket, pool, max_in_flight, on_close):
+        self._socket = client_socket
+        self._pool = pool
+        self._max_in_flight = max_in_flight
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._on_close = on_close
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+    
+    def start(self):
+        self._thread.start()
+    
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+    
+    def _run(self):
+        try:
+            self._send(("ready", protocol.VERSION))
+            for message in _read_messages(self._socket):
+                self._in_flight.acquire()
+                self._submit(message)
+            
+            # Let the requests that are still running send their responses
+            for _ in range(self._max_in_flight):
+                self._in_flight.acquire()
+        except socket.error:
+            pass
+        finally:
+            self._socket.close()
+            self._on_close(self)
+    
+    def _submit(self, message):
+        command, request_id = message[:2]
+        if command == "execute":
+            (creation_sql, query) = message[2:]
+            pending_result = self._pool.submit(creation_sql, query)
+            serialise = serialise_result
+        elif command == "execute_many":
+            (creation_sql, queries) = message[2:]
+            pending_result = self._pool.submit_many(creation_sql, queries)
+            serialise = lambda results: map(serialise_result, results)
+        else:
+            self._respond(request_id, "Unknown command: {0}".format(command), None)
+            return
+        
+        def finished(pending_result):
+            try:
+                result = pending_result.result()
+            except Exception as error:
+                self._respond(request_id, str(error), None)
+            else:
+                self._respond(request_id, None, serialise(result))
+        
+        pending_result.add_done_callback(finished)
+    
+    def _respond(self, request_id, error, result):
+        try:
+            self._send((request_id, error, result))
+        except socket.error:
+            # The client has gone away, so there's no one to tell
+            pass
+        finally:
+            self._in_flight.release()
+    
+    def _send(self, message):
+        with self._write_lock:
+            self._socket.sendall(protocol.encode(message))
+
+
+class DaemonClient(object):
+    # Requests from any number of threads are multiplexed over a single
+    # connection to the daemon
+    
+    def __init__(self, socket_path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._messages = _read_messages(self._socket)
+        
+        message = next(self._messages, None)
+        if message != ["ready", protocol.VERSION]:
+            self._socket.close()
+            raise DaemonError("Unexpected handshake from daemon: {0!r}".format(message))
+        
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._pending = {}
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def execute(self, creation_sql, query):
+        return self.submit(creation_sql, query).result()
+    
+    def submit(self, creation_sql, query):
+        return self._submit(
+            ("execute", creation_sql, query),
+            lambda serialised: deserialise_result(query, serialised),
+        )
+    
+    def execute_many(self, creation_sql, queries):
+        return self.submit_many(creation_sql, queries).result()
+    
+    def submit_many(self, creation_sql, queries):
+        return self._submit(
+            ("execute_many", creation_sql, queries),
+            lambda serialised: [
+                deserialise_result(query, serialised_result)
+                for query, serialised_result in zip(queries, serialised)
+            ],
+        )
+    
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._thread.join()
+        self._socket.close()
+    
+    def _submit(self, request, deserialise):
+        pending_result = PendingResult()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            request_id = next(self._request_ids)
+            self._pending[request_id] = (pending_result, deserialise)
+        
+        # Sending blocks once the daemon stops reading our requests. The
+        # lock for pending requests isn't held meanwhile, so that responses
+        # can still be read.
+        try:
+            with self._send_lock:
+                self._socket.sendall(protocol.encode((request[0], request_id) + request[1:]))
+        except socket.error as error:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise DaemonError("Could not send request to daemon: {0}".format(error))
+        return pending_result
+    
+    def _run(self):
+        try:
+            for (request_id, error, serialised) in self._messages:
+                with self._lock:
+                    pending_result, deserialise = self._pending.pop(request_id)
+                if error is None:
+                    pending_result.set_result(deserialise(serialised))
+                else:
+                    pending_result.set_error(DaemonError(error))
+        except socket.error:
+            pass
+        finally:
+            with self._lock:
+                self._error = DaemonError("Connection to daemon was closed")
+                pending = self._pending.values()
+                self._pending = {}
+            for pending_result, _ in pending:
+                pending_result.set_error(self._error)
+
+
+class DaemonError(Exception):
+    pass
+
+
+def _read_messages(sock):
+    reader = protocol.FrameReader()
+    while True:
+        data = sock.recv(protocol.READ_SIZE)
+        if not data:
+            return
+        reader.feed(data)
+        for message in reader.messages():
+            yield message
+
+
+if __name__ == "__main__":
+    main()
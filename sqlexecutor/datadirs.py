@@ -0,0 +1,291 @@
+import errno
+import fcntl
+import hashlib
+import os
+import random
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+import Queue
+
+from .tempdir import create_temporary_dir
+
+
+def choose_strategy(template, runs=3):
+    timings = []
+    for strategy in strategies.values():
+        try:
+            elapsed = min(_time_strategy(strategy, template) for _ in range(runs))
+        except (OSError, IOError, subprocess.CalledProcessError):
+            # For instance, the filesystem doesn't support reflinks
+            continue
+        timings.append((elapsed, strategy.name))
+    return min(timings)[1]
+
+
+def _time_strategy(strategy, template):
+    start = time.time()
+    data_dir = strategy.create(template)
+    elapsed = time.time() - start
+    data_dir.close()
+    return elapsed
+
+
+class CopyStrategy(object):
+    name = "copy"
+    
+    def create(self, template):
+        return _create_data_dir(template, _copy_tree)
+
+
+class ReflinkStrategy(object):
+    # Copy-on-write clones, on filesystems such as btrfs and XFS that
+    # support them
+    name = "reflink"
+    
+    def create(self, template):
+        def copy(source, destination):
+            subprocess.check_call(["cp", "-rT", "--reflink=always", source, destination])
+        
+        return _create_data_dir(template, copy)
+
+
+class HardlinkStrategy(object):
+    # Files that mysqld never writes to can be shared with the template.
+    # Everything else still has to be copied.
+    name = "hardlink"
+    
+    def create(self, template):
+        def copy(source, destination):
+            _copy_tree(source, destination, should_link=_is_read_only)
+        
+        # Hard links only work within a single filesystem
+        return _create_data_dir(template, copy, parent=os.path.dirname(template))
+
+
+class TmpfsStrategy(object):
+    # The template is copied to tmpfs once, and the copy is shared by every
+    # data dir created from it, in this process or any other. Each process
+    # using the copy holds a shared lock on it, and the last process to stop
+    # using it removes it, so it only takes up memory while it's needed.
+    name = "tmpfs"
+    
+    def __init__(self, path="/dev/shm"):
+        self._path = path
+    
+    def create(self, template):
+        if not os.path.isdir(self._path):
+            raise OSError(errno.ENOENT, "No tmpfs at {0}".format(self._path))
+        
+        tmpfs_template = os.path.join(self._path, "sqlexecutor-template-{0}".format(_template_key(template)))
+        _tmpfs_templates.acquire(tmpfs_template, template)
+        try:
+            data_dir = _create_data_dir(tmpfs_template, _copy_tree, parent=self._path)
+        except:
+            _tmpfs_templates.release(tmpfs_template)
+            raise
+        return _SharedTemplateDataDir(data_dir, lambda: _tmpfs_templates.release(tmpfs_template))
+
+
+class _TmpfsTemplates(object):
+    # Locks taken with flock() belong to an open file rather than to a
+    # process, so each process only opens each lock file once, and counts
+    # how many of its data dirs are using the copy
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+    
+    def acquire(self, tmpfs_template, template):
+        with self._lock:
+            if tmpfs_template in self._users:
+                lock_file, count = self._users[tmpfs_template]
+            else:
+                lock_file, count = _lock_tmpfs_template(tmpfs_template, template), 0
+            self._users[tmpfs_template] = (lock_file, count + 1)
+    
+    def release(self, tmpfs_template):
+        with self._lock:
+            lock_file, count = self._users.pop(tmpfs_template)
+            if count > 1:
+                self._users[tmpfs_template] = (lock_file, count - 1)
+            else:
+                _unlock_tmpfs_template(tmpfs_template, lock_file)
+
+
+_tmpfs_templates = _TmpfsTemplates()
+
+
+def _lock_tmpfs_template(tmpfs_template, template):
+    # Every process using the copy holds a shared lock, so an exclusive lock
+    # is only tried for when the copy needs creating, and never waited for
+    lock_path = tmpfs_template + ".lock"
+    while True:
+        is_contended = False
+        lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            # The last user of the copy may have removed the lock file while
+            # we were waiting for it
+            if _is_same_file(lock_file, lock_path):
+                if os.path.exists(tmpfs_template):
+                    return lock_file
+                elif _try_lock_exclusively(lock_file):
+                    if not os.path.exists(tmpfs_template):
+                        _copy_to_tmpfs(template, tmpfs_template)
+                else:
+                    is_contended = True
+        except:
+            lock_file.close()
+            raise
+        
+        # Start again with a shared lock, which waits for any process that's
+        # creating the copy to finish
+        lock_file.close()
+        if is_contended:
+            # Another process that found the copy missing at the same time
+            # may be trying for the exclusive lock too
+            time.sleep(random.uniform(0, 0.05))
+
+
+def _try_lock_exclusively(lock_file):
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except IOError:
+        return False
+
+
+def _copy_to_tmpfs(template, tmpfs_template):
+    # Copied under a different name first so that a process that dies part
+    # way through doesn't leave an incomplete copy
+    partial_path = "{0}.{1}".format(tmpfs_template, uuid.uuid4())
+    os.mkdir(partial_path)
+    try:
+        _copy_tree(template, partial_path)
+        os.rename(partial_path, tmpfs_template)
+    except:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+
+
+def _unlock_tmpfs_template(tmpfs_template, lock_file):
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        # Another process is still using the copy
+        pass
+    else:
+        shutil.rmtree(tmpfs_template, ignore_errors=True)
+        os.remove(tmpfs_template + ".lock")
+    finally:
+        lock_file.close()
+
+
+class _SharedTemplateDataDir(object):
+    def __init__(self, data_dir, release):
+        self._data_dir = data_dir
+        self._release = release
+        self.path = data_dir.path
+    
+    def close(self):
+        try:
+            self._data_dir.close()
+        finally:
+            self._release()
+
+
+def _is_same_file(open_file, path):
+    try:
+        return os.path.samestat(os.fstat(open_file.fileno()), os.stat(path))
+    except OSError:
+        return False
+
+
+def _template_key(template):
+    # Templates are rebuilt in place, for instance when the mysqld options
+    # change, so the key depends on the files as well as the path
+    template = os.path.abspath(template)
+    digest = hashlib.sha1(template)
+    for dir_path, dir_names, file_names in sorted(os.walk(template)):
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            stat = os.stat(path)
+            digest.update("\0{0}\0{1}\0{2!r}".format(os.path.relpath(path, template), stat.st_size, stat.st_mtime))
+    return digest.hexdigest()[:16]
+
+
+strategies = dict(
+    (strategy.name, strategy)
+    for strategy in [CopyStrategy(), ReflinkStrategy(), HardlinkStrategy(), TmpfsStrategy()]
+)
+
+
+def _create_data_dir(template, copy, parent=None):
+    data_dir = create_temporary_dir(dir=parent)
+    try:
+        copy(template, data_dir.path)
+        return data_dir
+    except:
+        data_dir.close()
+        raise
+
+
+def _is_read_only(path):
+    # Table definitions and database options are only written by DDL, which
+    # never runs against the system databases
+    name = os.path.basename(path)
+    return name.endswith(".frm") or name == "db.opt"
+
+
+def _copy_tree(source, destination, should_link=None):
+    files = []
+    for dir_path, dir_names, file_names in os.walk(source):
+        destination_dir = os.path.normpath(os.path.join(destination, os.path.relpath(dir_path, source)))
+        if not os.path.isdir(destination_dir):
+            os.mkdir(destination_dir)
+        shutil.copymode(dir_path, destination_dir)
+        for file_name in file_names:
+            files.append((os.path.join(dir_path, file_name), os.path.join(destination_dir, file_name)))
+    
+    def copy_file(paths):
+        source_path, destination_path = paths
+        if should_link is not None and should_link(source_path):
+            os.link(source_path, destination_path)
+        else:
+            shutil.copyfile(source_path, destination_path)
+            shutil.copymode(source_path, destination_path)
+    
+    # The InnoDB system tablespace and log files are much bigger than
+    # everything else, so copying files in parallel stops the small files
+    # queueing up behind them
+    _run_in_parallel(copy_file, files)
+
+
+def _run_in_parallel(func, items, thread_count=4):
+    queue = Queue.Queue()
+    for item in items:
+        queue.put(item)
+    errors = []
+    
+    def run():
+        while not errors:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                func(item)
+            except Exception as error:
+                errors.append(error)
+    
+    threads = [threading.Thread(target=run) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    if errors:
+        raise errors[0]
@@ -0,0 +1,34 @@
+import math
+import os
+import resource
+
+
+memory_error = "The query used too much memory"
+
+cpu_error = "The query used too much CPU time"
+
+worker_exited_error = "The executor stopped while running the query, possibly because it exceeded its resource limits"
+
+
+def limit_worker(resource_limits):
+    # Run in the worker process before it starts. The address space limit
+    # makes allocations fail with MemoryError rather than pushing the
+    # host into swap. Servers started by the worker, such as mysqld,
+    # inherit the limit too, so it needs to leave room for them.
+    os.setpgrp()
+    address_space = resource_limits.get("address_space")
+    if address_space is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (address_space, address_space))
+
+
+def limit_cpu_time(cpu_seconds):
+    # RLIMIT_CPU counts all of the CPU time that a process has used, so the
+    # soft limit is moved on before each query to give that query its own
+    # allowance. Going over it kills the worker with SIGXCPU. The hard limit
+    # is left alone, since it could never be raised again.
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft_limit = int(math.ceil(usage.ru_utime + usage.ru_stime + cpu_seconds))
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard_limit != resource.RLIM_INFINITY:
+        soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft_limit, hard_limit))
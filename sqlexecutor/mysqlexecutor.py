@@ -1,32 +1,123 @@
 import os
+import re
+import socket
 import subprocess
+import threading
 import time
+import collections
+import hashlib
 import uuid
 
 import MySQLdb
+import MySQLdb.cursors
 import spur
 
 from .tempdir import create_temporary_dir
+from . import datadirs
+from .snapshots import NoSnapshot
+from .timings import Timings
+from .results import QueryPlan
 
 
 _local = spur.LocalShell()
 
+
+mysqld_profiles = {
+    "default": {},
+    
+    # For servers whose databases only last for a single query: nothing
+    # needs to survive a crash, and many servers may share one host
+    "ephemeral": {
+        "innodb_flush_log_at_trx_commit": "0",
+        "innodb_doublewrite": "0",
+        "innodb_checksum_algorithm": "none",
+        "innodb_stats_persistent": "0",
+        "sync_frm": "0",
+        
+        "performance_schema": "0",
+        "innodb_buffer_pool_size": "16M",
+        "innodb_log_buffer_size": "1M",
+        "key_buffer_size": "1M",
+        "query_cache_size": "0",
+        "table_open_cache": "256",
+        "table_definition_cache": "400",
+        "innodb_read_io_threads": "1",
+        "innodb_write_io_threads": "1",
+        # Each server would otherwise reserve its own AIO contexts, which
+        # runs out when many servers share a host
+        "innodb_use_native_aio": "0",
+        
+        "innodb_log_file_size": "4M",
+        "innodb_log_files_in_group": "2",
+    },
+}
+
+# Options that change the files that mysql_install_db creates
+_data_dir_layout_options = set([
+    "innodb_log_file_size",
+    "innodb_log_files_in_group",
+    "innodb_page_size",
+    "innodb_data_file_path",
+])
+
 class MySqlDialect(object):
     DatabaseError = MySQLdb.MySQLError
     
-    def __init__(self, working_dir):
+    _start_attempts = 3
+    
+    def __init__(self, working_dir, pool_low_watermark=2, pool_high_watermark=4, reuse_databases=False,
+            data_dir_strategy=None, networking=True, profile="default", mysqld_options=None,
+            session_variables=None):
+        if profile not in mysqld_profiles:
+            raise ValueError("Unknown mysqld profile: {0}".format(profile))
+        
         self._working_dir = working_dir
+        self._pool_low_watermark = pool_low_watermark
+        self._pool_high_watermark = pool_high_watermark
+        self._reuse_databases = reuse_databases
+        self._data_dir_strategy_name = data_dir_strategy
+        self._networking = networking
+        # Options set to None remove that option from the profile
+        self._mysqld_options = dict(mysqld_profiles[profile])
+        self._mysqld_options.update(mysqld_options or {})
+        self._mysqld_options = dict(
+            (name, value)
+            for name, value in self._mysqld_options.iteritems()
+            if value is not None
+        )
+        # Set on each connection that runs queries, for instance to cap the
+        # memory used by a single query with tmp_table_size and
+        # max_heap_table_size, or the rows it may examine with max_join_size
+        self._session_variables = dict(session_variables or {})
+        for name in self._session_variables:
+            if not _variable_name_regex.match(name):
+                raise ValueError("Invalid session variable name: {0}".format(name))
     
     def start_server(self):
+        # The port is found before mysqld binds to it, so another server,
+        # such as one started by another worker in the pool, may take it
+        # first. mysqld then exits, and is started again on another port.
+        attempt = 1
+        while True:
+            try:
+                return self._start_server()
+            except _ServerExitedError:
+                if not self._networking or attempt >= self._start_attempts:
+                    raise
+                attempt += 1
+    
+    def _start_server(self):
         temp_dir = create_temporary_dir()
+        data_dir = None
         try:
             socket_path = os.path.join(temp_dir.path, "mysql.sock")
-            port = 55555
-            data_dir = os.path.join(temp_dir.path, "data")
+            # We always connect over the socket, so TCP is only needed for
+            # other clients
+            port = _find_free_port() if self._networking else None
             pid_file = os.path.join(temp_dir.path, "mysql.pid")
-            mysqld_args = self._mysqld_args(data_dir, pid_file, socket_path, port)
             
-            self._create_data_dir(data_dir)
+            data_dir = self._create_data_dir()
+            mysqld_args = self._mysqld_args(data_dir.path, pid_file, socket_path, port)
             
             mysql_process = _local.spawn(
                 ["bin/mysqld"] + mysqld_args,
@@ -38,15 +129,27 @@ class MySqlDialect(object):
             server = MySqlServer(
                 process=mysql_process,
                 temp_dir=temp_dir,
+                data_dir=data_dir,
                 socket_path=socket_path,
                 root_password="",
+                reuse_databases=self._reuse_databases,
+                session_variables=self._session_variables,
             )
         except:
+            if data_dir is not None:
+                data_dir.close()
             temp_dir.close()
             raise
+        
+        def connect_as_root():
+            if not mysql_process.is_running():
+                result = mysql_process.wait_for_result()
+                raise _ServerExitedError("mysqld exited while starting:\n{0}".format(result.stderr_output))
+            return server.connect_as_root()
+        
         try:
             connection = _retry(
-                lambda: server.connect_as_root(),
+                connect_as_root,
                 MySQLdb.MySQLError,
                 timeout=10, interval=0.2
             )
@@ -58,6 +161,10 @@ class MySqlDialect(object):
                 connection.close()
                 
             server._root_password = root_password
+            server._start_slot_pool(
+                low_watermark=self._pool_low_watermark,
+                high_watermark=self._pool_high_watermark,
+            )
             
             return server
         except:
@@ -67,18 +174,51 @@ class MySqlDialect(object):
     def prepare(self):
         self._download_mysql()
         self._create_data_dir_template()
+        self._choose_data_dir_strategy()
     
-    def _create_data_dir(self, data_dir):
-        _local.run(["cp", "-rT", self._data_dir_template(), data_dir])
+    def _create_data_dir(self):
+        return self._data_dir_strategy().create(self._data_dir_template())
+    
+    def _data_dir_strategy(self):
+        name = self._data_dir_strategy_name
+        if name is None and os.path.exists(self._data_dir_strategy_path()):
+            with open(self._data_dir_strategy_path()) as strategy_file:
+                name = strategy_file.read().strip()
+        return datadirs.strategies.get(name, datadirs.strategies["copy"])
+    
+    def _choose_data_dir_strategy(self):
+        # Which strategy is fastest depends on the filesystems available, so
+        # benchmark them once and remember the winner
+        path = self._data_dir_strategy_path()
+        if not os.path.exists(path):
+            name = datadirs.choose_strategy(self._data_dir_template())
+            with open(path, "w") as strategy_file:
+                strategy_file.write(name)
+    
+    def _data_dir_strategy_path(self):
+        return os.path.join(self._working_dir, "data-dir-strategy")
     
     def _mysqld_args(self, data_dir, pid_file, socket_path, port):
+        if port is None:
+            networking_args = ["--skip-networking"]
+        else:
+            networking_args = ["--port={0}".format(port)]
+        
         return [
             "--no-defaults",
             "--basedir=.",
             "--datadir={0}".format(data_dir),
-            "--port={0}".format(port),
+        ] + networking_args + [
             "--socket={0}".format(socket_path),
             "--pid-file={0}".format(pid_file),
+        ] + self._tuning_args()
+    
+    def _tuning_args(self):
+        # Options are loose so that ones this version of mysqld doesn't know
+        # about are ignored rather than stopping the server from starting
+        return [
+            "--loose-{0}={1}".format(name.replace("_", "-"), value)
+            for name, value in sorted(self._mysqld_options.iteritems())
         ]
     
     def _create_data_dir_template(self):
@@ -90,7 +230,7 @@ class MySqlDialect(object):
                     "--no-defaults",
                     "--basedir=.",
                     "--datadir={0}".format(data_dir_template),
-                ],
+                ] + self._tuning_args(),
                 cwd=self._mysql_install_dir(),
             )
     
@@ -116,57 +256,288 @@ class MySqlDialect(object):
         return tarball_path
     
     def _data_dir_template(self):
-        return os.path.join(self._working_dir, "data-5.6.13")
+        # mysqld recreates its log files on every start if their size
+        # doesn't match the options, so each layout has its own template
+        layout = sorted(
+            (name, value)
+            for name, value in self._mysqld_options.iteritems()
+            if name in _data_dir_layout_options
+        )
+        if layout:
+            layout_hash = hashlib.sha1(repr(layout)).hexdigest()[:8]
+            return os.path.join(self._working_dir, "data-5.6.13-{0}".format(layout_hash))
+        else:
+            return os.path.join(self._working_dir, "data-5.6.13")
     
     def _mysql_install_dir(self):
         return os.path.join(self._working_dir, "mysql-5.6.13")
 
     
 class MySqlConnection(object):
-    def __init__(self, connection, name):
+    def __init__(self, connection, name, password=None, on_close=None, kill_query=None):
         self._connection = connection
         self._name = name
+        self._password = password
+        self._on_close = on_close
+        self._kill_query = kill_query
+        self._thread_id = connection.thread_id()
+        self._rows_read_before = None
+        self._status_rows_read = None
     
     def cursor(self):
         return self._connection.cursor()
     
+    def streaming_cursor(self):
+        # The default cursor reads the whole result into memory as soon as
+        # the query is executed
+        return self._connection.cursor(MySQLdb.cursors.SSCursor)
+    
+    def explain(self, query):
+        cursor = self._connection.cursor()
+        cursor.execute("EXPLAIN " + query)
+        return QueryPlan([column[0] for column in cursor.description], map(list, cursor.fetchall()))
+    
+    def start_statistics(self):
+        cursor = self._connection.cursor()
+        cursor.execute("SET profiling = 1")
+        # SHOW STATUS reads rows itself, which are counted as well. Reading
+        # the counters twice tells us how many of those to ignore later.
+        first_rows_read = _rows_read(cursor)
+        self._rows_read_before = _rows_read(cursor)
+        self._status_rows_read = self._rows_read_before - first_rows_read
+    
+    def finish_statistics(self, plan):
+        cursor = self._connection.cursor()
+        # SHOW PROFILES isn't itself profiled until it has finished, so the
+        # query is the most recent profile
+        cursor.execute("SHOW PROFILES")
+        profiles = cursor.fetchall()
+        if profiles:
+            plan.server_seconds = float(profiles[-1][1])
+        rows_read = _rows_read(cursor) - self._rows_read_before - self._status_rows_read
+        plan.rows_examined = max(0, rows_read)
+    
     def error_message(self, error):
         return error[1].replace(self._name, "db")
+    
+    def cancel(self):
+        # Called from another thread while a query is running, so this can't
+        # use the connection itself
+        self._kill_query(self._thread_id)
         
     def close(self):
         self._connection.close()
+        if self._on_close is not None:
+            self._on_close(self)
 
 
 class MySqlServer(object):
-    def __init__(self, process, temp_dir, socket_path, root_password):
+    def __init__(self, process, temp_dir, data_dir, socket_path, root_password, reuse_databases=False,
+            session_variables=None):
         self._process = process
         self._temp_dir = temp_dir
+        self._data_dir = data_dir
         self._socket_path = socket_path
         self._root_password = root_password
+        self._reuse_databases = reuse_databases
+        self._session_variables = session_variables or {}
+        self._slots = None
+        # Once a slot has been put back in the pool, reclaiming it again
+        # would drop a database that may be in use. When slots are reused,
+        # each is reclaimed on its own so that retrying a failed batch never
+        # includes a slot that's already been reused.
+        self._reclaimer = _Reclaimer(self._reclaim, batch_size=1 if reuse_databases else 16)
 
-    def connect(self):
-        database_name = str(uuid.uuid4()).replace("-", "")[:16]
-        password = str(uuid.uuid4())
+    def connect(self, snapshot=None, timings=None, creation_script=None):
+        # Connections are never reused, so the creation script that's about
+        # to be replayed doesn't change how they're opened
+        if timings is None:
+            timings = Timings()
+        
+        # Provisioning is either CREATE DATABASE and GRANT, or waiting for a
+        # slot that the pool has already provisioned
+        with timings.stage("provision"):
+            if self._slots is None:
+                connection = self._provision_slot()
+            else:
+                connection = self._slots.take()
+        
+        if snapshot is not None:
+            try:
+                with timings.stage("restore"):
+                    root_connection = self.connect_as_root()
+                    try:
+                        snapshot.restore(root_connection.cursor(), connection._name)
+                    finally:
+                        root_connection.close()
+            except:
+                connection.close()
+                raise
+        
+        return connection
+    
+    def create_snapshot(self, creation_script):
+        # Temporary tables and variables set with SET, such as sql_mode, only
+        # last as long as the connection that created them, so they can't be
+        # captured in a template database
+        if any(_connection_state_regex.search(statement) for statement in creation_script):
+            return NoSnapshot()
+        
         connection = self.connect_as_root()
         try:
             cursor = connection.cursor()
-            cursor.execute("CREATE DATABASE `{0}`".format(database_name))
-            cursor.execute(
-                "GRANT ALL PRIVILEGES ON `{0}`.* TO %s@'localhost' IDENTIFIED BY %s".format(database_name),
-                (database_name, password,)
-            )
-            # TODO: tidy up user
-            return MySqlConnection(self._connect_as_user(
-                username=database_name,
-                password=password,
-                database=database_name,
-            ), database_name)
+            database_name, password = self._create_database(cursor)
+            try:
+                try:
+                    user_connection = self._connect_as_user(
+                        username=database_name,
+                        password=password,
+                        database=database_name,
+                    )
+                    try:
+                        user_cursor = user_connection.cursor()
+                        for statement in creation_script:
+                            user_cursor.execute(statement)
+                    finally:
+                        user_connection.close()
+                finally:
+                    cursor.execute("DROP USER %s@'localhost'", (database_name, ))
+                
+                if not _contains_only_tables(cursor, database_name):
+                    _drop_database(cursor, database_name)
+                    return NoSnapshot()
+                
+                cursor.execute(
+                    "SELECT table_name, auto_increment, data_length + index_length " +
+                    "FROM information_schema.tables WHERE table_schema = %s",
+                    (database_name, )
+                )
+                rows = cursor.fetchall()
+                return MySqlSnapshot(
+                    server=self,
+                    database_name=database_name,
+                    tables=[(name, auto_increment) for name, auto_increment, _ in rows],
+                    size=sum(size or 0 for _, _, size in rows),
+                )
+            except:
+                _drop_database(cursor, database_name)
+                raise
         finally:
             connection.close()
-
+    
     def connect_as_root(self):
         return self._connect_as_user("root", self._root_password)
 
+    def _start_slot_pool(self, low_watermark, high_watermark):
+        if high_watermark > 0:
+            max_idle_seconds = 60 * 60
+            if "wait_timeout" in self._session_variables:
+                max_idle_seconds = min(max_idle_seconds, int(self._session_variables["wait_timeout"]) / 2)
+            self._slots = _SlotPool(
+                provision=self._provision_slot,
+                low_watermark=low_watermark,
+                high_watermark=high_watermark,
+                max_idle_seconds=max_idle_seconds,
+            )
+    
+    def reclamation_counts(self):
+        return self._reclaimer.counts()
+    
+    def _provision_slot(self):
+        connection = self.connect_as_root()
+        try:
+            database_name, password = self._create_database(connection.cursor())
+        finally:
+            connection.close()
+        
+        return self._slot_connection(database_name, password)
+    
+    def _slot_connection(self, database_name, password):
+        user_connection = self._connect_as_user(
+            username=database_name,
+            password=password,
+            database=database_name,
+        )
+        if self._session_variables:
+            try:
+                user_connection.cursor().execute(*_set_session_variables(self._session_variables))
+            except:
+                user_connection.close()
+                raise
+        
+        return MySqlConnection(
+            user_connection,
+            database_name,
+            password=password,
+            on_close=self._release,
+            kill_query=self._kill_query,
+        )
+    
+    def _kill_query(self, thread_id):
+        connection = self.connect_as_root()
+        try:
+            connection.cursor().execute("KILL QUERY {0}".format(int(thread_id)))
+        finally:
+            connection.close()
+    
+    def _release(self, connection):
+        self._reclaimer.add((connection._name, connection._password))
+    
+    def _reclaim(self, slots):
+        unused_users = []
+        reused_count = 0
+        connection = self.connect_as_root()
+        try:
+            cursor = connection.cursor()
+            for database_name, password in slots:
+                _drop_database(cursor, database_name)
+                if self._reuse_slot(cursor, database_name, password):
+                    reused_count += 1
+                else:
+                    unused_users.append(database_name)
+            
+            if unused_users:
+                cursor.execute(
+                    "DROP USER " + ", ".join(["%s@'localhost'"] * len(unused_users)),
+                    unused_users,
+                )
+        finally:
+            connection.close()
+        
+        return len(unused_users), reused_count
+    
+    def _reuse_slot(self, cursor, database_name, password):
+        if not self._reuse_databases or self._slots is None or self._slots.is_full():
+            return False
+        
+        # The grant refers to the database by name, so it still applies once
+        # the database has been recreated
+        cursor.execute("CREATE DATABASE {0}".format(_quote_identifier(database_name)))
+        try:
+            slot = self._slot_connection(database_name, password)
+        except MySQLdb.MySQLError:
+            # For instance, the user may have changed their own password
+            _drop_database(cursor, database_name)
+            return False
+        
+        if self._slots.give_back(slot):
+            return True
+        else:
+            slot._connection.close()
+            _drop_database(cursor, database_name)
+            return False
+    
+    
+    def _create_database(self, cursor):
+        database_name = str(uuid.uuid4()).replace("-", "")[:16]
+        password = str(uuid.uuid4())
+        cursor.execute("CREATE DATABASE {0}".format(_quote_identifier(database_name)))
+        cursor.execute(
+            "GRANT ALL PRIVILEGES ON {0}.* TO %s@'localhost' IDENTIFIED BY %s".format(_quote_identifier(database_name)),
+            (database_name, password,)
+        )
+        return database_name, password
+
     def _connect_as_user(self, username, password, database=None):
         connect_kwargs = {
             "host": "localhost",
@@ -179,11 +550,274 @@ class MySqlServer(object):
         return MySQLdb.connect(**connect_kwargs)
         
     def close(self):
-        self._process.send_signal(15)
+        self._reclaimer.close()
+        if self._slots is not None:
+            self._slots.close()
+        if self._process.is_running():
+            self._process.send_signal(15)
         self._process.wait_for_result()
+        self._data_dir.close()
         self._temp_dir.close()
 
 
+class _SlotPool(object):
+    # Keeps a supply of databases, each with its own user and an open
+    # connection as that user, so that connecting doesn't need to wait for
+    # CREATE DATABASE, GRANT or a connection handshake. Whenever the number
+    # of idle slots drops below the low watermark, a background thread tops
+    # the pool back up to the high watermark.
+    #
+    # mysqld closes connections that have been idle for longer than
+    # wait_timeout, so slots that have been idle for longer than
+    # max_idle_seconds are closed rather than handed out.
+    
+    def __init__(self, provision, low_watermark, high_watermark, max_idle_seconds=60 * 60, clock=time.time):
+        self._provision = provision
+        self._low_watermark = low_watermark
+        self._high_watermark = high_watermark
+        self._max_idle_seconds = max_idle_seconds
+        self._clock = clock
+        # Each slot is stored with the time it became idle, oldest first
+        self._slots = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        
+        thread = threading.Thread(target=self._fill)
+        thread.daemon = True
+        thread.start()
+    
+    def take(self):
+        slot = None
+        stale_slots = []
+        with self._condition:
+            while self._slots and slot is None:
+                idle_since, slot = self._slots.popleft()
+                if self._clock() - idle_since > self._max_idle_seconds:
+                    stale_slots.append(slot)
+                    slot = None
+            if len(self._slots) < self._low_watermark:
+                self._condition.notify()
+        
+        for stale_slot in stale_slots:
+            stale_slot.close()
+        
+        if slot is None:
+            return self._provision()
+        else:
+            return slot
+    
+    def give_back(self, slot):
+        with self._condition:
+            if self._closed or len(self._slots) >= self._high_watermark:
+                return False
+            self._slots.append((self._clock(), slot))
+            return True
+    
+    def is_full(self):
+        with self._condition:
+            return len(self._slots) >= self._high_watermark
+    
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            slots = [slot for _, slot in self._slots]
+            self._slots.clear()
+        for slot in slots:
+            slot.close()
+    
+    def _fill(self):
+        while True:
+            with self._condition:
+                while not self._closed and len(self._slots) >= self._low_watermark:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            
+            while self._needs_slot():
+                try:
+                    slot = self._provision()
+                except MySQLdb.MySQLError:
+                    # Stop filling until the next take(). If the server
+                    # really is broken, take() will surface the error when
+                    # it provisions a slot itself.
+                    break
+                with self._condition:
+                    if self._closed:
+                        slot.close()
+                        return
+                    self._slots.append((self._clock(), slot))
+            
+            with self._condition:
+                if len(self._slots) < self._low_watermark and not self._closed:
+                    self._condition.wait()
+    
+    def _needs_slot(self):
+        with self._condition:
+            return not self._closed and len(self._slots) < self._high_watermark
+
+
+class _Reclaimer(object):
+    # Drops the databases and users of closed connections on a background
+    # thread, so that neither the data dir nor mysql.user grow without
+    # bound on a long-running server
+    
+    def __init__(self, reclaim, batch_size=16):
+        self._reclaim = reclaim
+        self._batch_size = batch_size
+        self._queue = collections.deque()
+        self._in_progress = 0
+        self._dropped = 0
+        self._reused = 0
+        self._failed = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+    
+    def add(self, item):
+        with self._condition:
+            if not self._closed:
+                self._queue.append(item)
+                self._condition.notify()
+    
+    def counts(self):
+        with self._condition:
+            return {
+                "outstanding": len(self._queue) + self._in_progress,
+                "dropped": self._dropped,
+                "reused": self._reused,
+                "failed": self._failed,
+            }
+    
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._queue.clear()
+            self._condition.notify()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._queue:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                batch_size = min(self._batch_size, len(self._queue))
+                batch = [self._queue.popleft() for _ in range(batch_size)]
+                self._in_progress = batch_size
+            
+            try:
+                dropped, reused = self._reclaim(batch)
+            except MySQLdb.MySQLError:
+                dropped, reused, failed = self._reclaim_each(batch)
+            else:
+                failed = 0
+            
+            with self._condition:
+                self._in_progress = 0
+                self._dropped += dropped
+                self._reused += reused
+                self._failed += failed
+
+
+    def _reclaim_each(self, batch):
+        # One item failing shouldn't stop the rest of its batch from being
+        # reclaimed
+        dropped, reused, failed = 0, 0, 0
+        for item in batch:
+            try:
+                item_dropped, item_reused = self._reclaim([item])
+            except MySQLdb.MySQLError:
+                failed += 1
+            else:
+                dropped += item_dropped
+                reused += item_reused
+        return dropped, reused, failed
+
+
+class MySqlSnapshot(object):
+    def __init__(self, server, database_name, tables, size):
+        self._server = server
+        self._database_name = database_name
+        self._tables = tables
+        self.size = size
+    
+    def restore(self, cursor, database_name):
+        for table_name, auto_increment in self._tables:
+            source = "{0}.{1}".format(_quote_identifier(self._database_name), _quote_identifier(table_name))
+            destination = "{0}.{1}".format(_quote_identifier(database_name), _quote_identifier(table_name))
+            cursor.execute("CREATE TABLE {0} LIKE {1}".format(destination, source))
+            cursor.execute("INSERT INTO {0} SELECT * FROM {1}".format(destination, source))
+            if auto_increment is not None:
+                cursor.execute("ALTER TABLE {0} AUTO_INCREMENT = {1}".format(destination, int(auto_increment)))
+    
+    def close(self):
+        connection = self._server.connect_as_root()
+        try:
+            _drop_database(connection.cursor(), self._database_name)
+        finally:
+            connection.close()
+
+
+_connection_state_regex = re.compile(r"\bTEMPORARY\b|^\s*SET\b", re.IGNORECASE)
+
+_variable_name_regex = re.compile(r"^[A-Za-z_]+$")
+
+
+def _set_session_variables(session_variables):
+    names = sorted(session_variables)
+    sql = "SET " + ", ".join("SESSION {0} = %s".format(name) for name in names)
+    return sql, [session_variables[name] for name in names]
+
+
+def _contains_only_tables(cursor, database_name):
+    # CREATE TABLE ... LIKE copies columns and indexes, but nothing that
+    # refers to other objects
+    queries = [
+        "SELECT COUNT(*) FROM information_schema.views WHERE table_schema = %s",
+        "SELECT COUNT(*) FROM information_schema.triggers WHERE trigger_schema = %s",
+        "SELECT COUNT(*) FROM information_schema.routines WHERE routine_schema = %s",
+        "SELECT COUNT(*) FROM information_schema.events WHERE event_schema = %s",
+        "SELECT COUNT(*) FROM information_schema.referential_constraints WHERE constraint_schema = %s",
+    ]
+    for query in queries:
+        cursor.execute(query, (database_name, ))
+        if cursor.fetchone()[0]:
+            return False
+    return True
+
+
+def _rows_read(cursor):
+    cursor.execute("SHOW SESSION STATUS LIKE 'Handler_read%'")
+    return sum(int(value) for _, value in cursor.fetchall())
+
+
+def _drop_database(cursor, database_name):
+    cursor.execute("DROP DATABASE IF EXISTS {0}".format(_quote_identifier(database_name)))
+
+
+def _quote_identifier(name):
+    return "`{0}`".format(name.replace("`", "``"))
+
+
+def _find_free_port():
+    # Each worker in an executor pool runs its own server, so they can't
+    # share a fixed port
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class _ServerExitedError(Exception):
+    pass
+
+
 def _retry(func, error_cls, timeout, interval):
     start_time = time.time()
     while True:
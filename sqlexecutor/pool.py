@@ -0,0 +1,190 @@
+import threading
+import traceback
+import Queue
+
+from .snapshots import script_key
+
+
+class ExecutorPool(object):
+    def __init__(self, create_executor, size, dispatch="least_loaded"):
+        if dispatch not in _dispatchers:
+            raise ValueError("Unknown dispatch: {0}".format(dispatch))
+        self._dispatcher = _dispatchers[dispatch]
+        self._lock = threading.Lock()
+        self._loads = [0] * size
+        self._workers = [
+            _Worker(create_executor(), on_finished=self._finished(index))
+            for index in range(size)
+        ]
+
+    def execute(self, creation_sql, query):
+        return self.submit(creation_sql, query).result()
+
+    def submit(self, creation_sql, query):
+        return self._submit(
+            creation_sql,
+            lambda executor: executor.execute(creation_sql, query),
+        )
+
+    def execute_many(self, creation_sql, queries):
+        return self.submit_many(creation_sql, queries).result()
+
+    def submit_many(self, creation_sql, queries):
+        # The whole batch goes to a single worker so that the creation script
+        # only needs to be run once
+        return self._submit(
+            creation_sql,
+            lambda executor: executor.execute_many(creation_sql, queries),
+        )
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()
+        for worker in self._workers:
+            worker.join()
+
+    def _submit(self, creation_sql, run):
+        pending_result = PendingResult(run)
+        self._choose_worker(creation_sql).submit(pending_result)
+        return pending_result
+
+    def _choose_worker(self, creation_sql):
+        with self._lock:
+            index = self._dispatcher(creation_sql, self._loads)
+            self._loads[index] += 1
+            return self._workers[index]
+
+    def _finished(self, index):
+        def finished():
+            with self._lock:
+                self._loads[index] -= 1
+
+        return finished
+
+
+def _least_loaded(creation_sql, loads):
+    return min(range(len(loads)), key=lambda index: loads[index])
+
+
+def _by_creation_script(creation_sql, loads):
+    # Sending the same creation script to the same worker each time means
+    # that its snapshot is already in that worker's cache
+    return int(script_key(creation_sql), 16) % len(loads)
+
+
+_dispatchers = {
+    "least_loaded": _least_loaded,
+    "creation_script": _by_creation_script,
+}
+
+
+class _Worker(object):
+    def __init__(self, executor, on_finished):
+        self._executor = executor
+        self._on_finished = on_finished
+        self._jobs = Queue.Queue()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, job):
+        self._jobs.put(job)
+
+    def close(self):
+        self._jobs.put(None)
+
+    def join(self):
+        self._thread.join()
+
+    def _run(self):
+        self._start_executor()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                self._executor.close()
+                return
+
+            job.run(self._executor)
+            # If the query timed out, the executor has lost its process.
+            # Start a replacement before saying that this worker is free, so
+            # that new queries are sent to other workers in the meantime.
+            self._start_executor()
+            self._on_finished()
+
+    def _start_executor(self):
+        try:
+            self._executor.start()
+        except Exception:
+            # The next query on this worker will try again, and report the
+            # error if starting still fails
+            pass
+
+
+class PendingResult(object):
+    def __init__(self, run=None):
+        self._run = run
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if timeout is None:
+            # Waiting with a timeout allows the wait to be interrupted
+            while not self._done.wait(60):
+                pass
+        elif not self._done.wait(timeout):
+            raise PendingResultTimeout()
+
+        if self._error is not None:
+            raise self._error
+        else:
+            return self._result
+
+    def add_done_callback(self, callback):
+        # Callbacks are run on the worker thread once the query has finished,
+        # or immediately if it already has. Event loops should hand the
+        # result back to their own thread, for instance with
+        # IOLoop.add_callback or reactor.callFromThread.
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def run(self, executor):
+        try:
+            result = self._run(executor)
+        except Exception as error:
+            self.set_error(error)
+        else:
+            self.set_result(result)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_error(self, error):
+        self._error = error
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                # Don't let a broken callback take down the worker
+                traceback.print_exc()
+
+
+class PendingResultTimeout(Exception):
+    pass
@@ -1,40 +1,98 @@
 import sys
-
-import msgpack
+import json
+import signal
 
 import sqlexecutor
+from sqlexecutor import protocol
+from sqlexecutor.results import serialise_result
+from sqlexecutor.limits import limit_cpu_time
+
+
+# Dialects that can stop a query using too much CPU time themselves are
+# given this long to do so before the worker is killed
+_cpu_grace_period = 1
 
 
 def main():
-    dialect_name, working_dir = sys.argv[1:]
+    # Workers are stopped with SIGTERM, and the executor still needs closing
+    # so that the server's data dir is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    dialect_name, working_dir = sys.argv[1:3]
+    if len(sys.argv) > 3:
+        options = json.loads(sys.argv[3])
+    else:
+        options = {}
+    compression_threshold = options.get("compression_threshold", protocol.DEFAULT_COMPRESSION_THRESHOLD)
     
-    executor = sqlexecutor.executor(dialect_name, working_dir)
+    def send(message):
+        protocol.write_message(sys.stdout, message, compression_threshold=compression_threshold)
     
-    print "Ready"
-    sys.stdout.flush()
+    executor_options = options.get("executor", {})
+    snapshot_cache_options = executor_options.pop("snapshot_cache", None)
+    if snapshot_cache_options is not None:
+        executor_options["snapshot_cache"] = sqlexecutor.SnapshotCache(**snapshot_cache_options)
+    
+    executor = sqlexecutor.executor(dialect_name, working_dir, **executor_options)
+    cpu_seconds = options.get("cpu_seconds")
+    
+    send(("ready", protocol.VERSION))
     try:
-        for message in msgpack.Unpacker(sys.stdin, read_size=1):
+        messages = protocol.read_messages(sys.stdin.fileno())
+        for message in messages:
             command = message[0]
             args = message[1:]
             
-            if command == "execute":
-                (creation_sql, query, ) = args
-                result = executor.execute(creation_sql, query)
+            if cpu_seconds is not None:
+                if command == "execute_many":
+                    limit_cpu_time((cpu_seconds + _cpu_grace_period) * len(args[1]))
+                else:
+                    limit_cpu_time(cpu_seconds + _cpu_grace_period)
+            
+            if command == "execute_streaming":
+                (creation_sql, query, chunk_size, timeout) = args
+                result = executor.execute(
+                    creation_sql,
+                    query,
+                    stream=True,
+                    chunk_size=chunk_size,
+                    timeout=timeout,
+                )
                 if result.table is None:
-                    column_names = None
-                    rows = None
+                    send((result.error, None, result.timings))
                 else:
-                    column_names = result.table.column_names
-                    rows = result.table.rows
-                
-                
-                msgpack.dump((result.error, column_names, rows), sys.stdout)
-                sys.stdout.flush()
+                    send((result.error, result.table.column_names, result.timings))
+                    _send_chunks(result.table, messages, send)
+            elif command == "execute":
+                (creation_sql, query, timeout, explain) = args
+                result = executor.execute(creation_sql, query, timeout=timeout, explain=explain)
+                send(serialise_result(result))
+            elif command == "execute_many":
+                (creation_sql, queries, timeout) = args
+                results = executor.execute_many(creation_sql, queries, timeout=timeout)
+                send(map(serialise_result, results))
             else:
                 return
             
     finally:
         executor.close()
+
+
+def _send_chunks(table, messages, send):
+    chunks = table.chunks()
+    try:
+        for message in messages:
+            if message[0] != "next":
+                return
+            
+            chunk = next(chunks, None)
+            if chunk is None:
+                send(("end", table.truncated))
+                return
+            else:
+                send(("chunk", chunk))
+    finally:
+        table.close()
     
     
 if __name__ == "__main__":
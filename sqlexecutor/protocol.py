@@ -0,0 +1,79 @@
+import os
+import struct
+import zlib
+
+import msgpack
+
+
+VERSION = 5
+
+DEFAULT_COMPRESSION_THRESHOLD = 64 * 1024
+
+READ_SIZE = 64 * 1024
+
+# Each frame is the length of the payload, a byte of flags, and then the
+# payload itself, which is a msgpack message that may have been compressed
+_header = struct.Struct(">IB")
+
+_COMPRESSED = 1
+
+
+def encode(message, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    payload = msgpack.packb(message)
+    flags = 0
+    if compression_threshold is not None and len(payload) >= compression_threshold:
+        payload = zlib.compress(payload, 1)
+        flags |= _COMPRESSED
+    return _header.pack(len(payload), flags) + payload
+
+
+def write_message(output, message, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    output.write(encode(message, compression_threshold=compression_threshold))
+    output.flush()
+
+
+def read_messages(fd):
+    reader = FrameReader()
+    while True:
+        data = os.read(fd, READ_SIZE)
+        if not data:
+            return
+        reader.feed(data)
+        for message in reader.messages():
+            yield message
+
+
+class FrameReader(object):
+    def __init__(self):
+        self._chunks = []
+        self._buffered = 0
+        self._header = None
+
+    def feed(self, data):
+        self._chunks.append(data)
+        self._buffered += len(data)
+
+    def messages(self):
+        while True:
+            if self._header is None:
+                if self._buffered < _header.size:
+                    return
+                self._header = _header.unpack(self._take(_header.size))
+
+            length, flags = self._header
+            if self._buffered < length:
+                return
+            payload = self._take(length)
+            self._header = None
+
+            if flags & _COMPRESSED:
+                payload = zlib.decompress(payload)
+            yield msgpack.unpackb(payload)
+
+    def _take(self, size):
+        # Joining only once the whole frame has arrived keeps reading large
+        # frames linear in their size
+        data = "".join(self._chunks)
+        self._chunks = [data[size:]]
+        self._buffered -= size
+        return data[:size]
@@ -0,0 +1,332 @@
+import collections
+import hashlib
+import os
+import re
+import threading
+import time
+
+import msgpack
+
+from .results import Result, ResultTable, encode_columns, decode_columns, timeout_error
+from .limits import memory_error, cpu_error, worker_exited_error
+from .scripts import normalise_statement
+
+
+# Stored with each entry on disk, so that entries written in an older
+# format are ignored rather than misread
+_disk_format_version = 2
+
+# These depend on the limits and on how busy the machine was rather than
+# only on the query
+_uncacheable_errors = set([timeout_error, memory_error, cpu_error, worker_exited_error])
+
+# Results of queries that call these can change from one run to the next,
+# so they're never cached. Each MySQL query runs as its own user in its own
+# database, so the names of those change too.
+_non_deterministic_regex = re.compile(
+    r"\b(?:rand|random|randomblob|uuid|uuid_short|now|sysdate|curdate|curtime|"
+    r"current_date|current_time|current_timestamp|localtime|localtimestamp|"
+    r"utc_date|utc_time|utc_timestamp|unix_timestamp|last_insert_id|"
+    r"connection_id|changes|total_changes|sleep|get_lock|current_user)\b|'now'|"
+    # Common names for tables and columns, so only matched when called
+    r"\b(?:database|schema|user|session_user|system_user)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def result_key(namespace, creation_script, query):
+    if isinstance(creation_script, basestring):
+        creation_script = [creation_script]
+
+    digest = hashlib.sha1()
+    for part in [namespace] + list(creation_script) + [query]:
+        digest.update(normalise_statement(part))
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+def is_deterministic(creation_script, query):
+    if isinstance(creation_script, basestring):
+        creation_script = [creation_script]
+
+    return not any(
+        _non_deterministic_regex.search(statement)
+        for statement in list(creation_script) + [query]
+    )
+
+
+class ResultCache(object):
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=None,
+            disk_dir=None, max_disk_entries=64 * 1024, max_disk_bytes=1024 * 1024 * 1024, clock=time.time):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._disk_dir = disk_dir
+        self._max_disk_entries = max_disk_entries
+        self._max_disk_bytes = max_disk_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Each entry is the time it was added and the serialised result,
+        # which stops callers from changing the cached rows
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        # The size of each entry on disk, least recently used first. Entries
+        # written by other caches sharing the directory since this one was
+        # created aren't included until they're read.
+        self._disk_entries = collections.OrderedDict()
+        self._disk_size = 0
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._uncacheable = 0
+
+        if disk_dir is not None:
+            if not os.path.exists(disk_dir):
+                os.makedirs(disk_dir)
+            self._load_disk_entries()
+
+    def get(self, key, query):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and self._has_expired(entry):
+                self._size -= len(entry[1])
+                entry = None
+
+            if entry is not None:
+                self._entries[key] = entry
+                self._hits += 1
+                return _deserialise(query, entry[1])
+
+        entry = self._read_from_disk(key)
+        if entry is not None:
+            try:
+                result = _deserialise(query, entry[1])
+            except Exception:
+                self._remove_from_disk(key)
+                entry = None
+
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            else:
+                self._disk_hits += 1
+                self._add_entry(key, entry)
+                return result
+
+    def add(self, key, result):
+        entry = (self._clock(), _serialise(result))
+        with self._lock:
+            self._add_entry(key, entry)
+        self._write_to_disk(key, entry)
+
+    def record_uncacheable(self):
+        with self._lock:
+            self._uncacheable += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "uncacheable": self._uncacheable,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "disk_entries": len(self._disk_entries),
+                "disk_bytes": self._disk_size,
+            }
+
+    def _add_entry(self, key, entry):
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self._size -= len(old_entry[1])
+
+        self._entries[key] = entry
+        self._size += len(entry[1])
+        while self._entries and self._is_over_budget():
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted[1])
+
+    def _is_over_budget(self):
+        return len(self._entries) > self._max_entries or self._size > self._max_bytes
+
+    def _has_expired(self, entry):
+        return self._ttl is not None and self._clock() - entry[0] > self._ttl
+
+    def _read_from_disk(self, key):
+        if self._disk_dir is None:
+            return None
+
+        path = os.path.join(self._disk_dir, key)
+        try:
+            with open(path, "rb") as entry_file:
+                data = entry_file.read()
+        except IOError:
+            with self._lock:
+                self._forget_disk_entry(key)
+            return None
+
+        try:
+            version, added, payload = msgpack.unpackb(data)
+        except Exception:
+            version = None
+        if version != _disk_format_version:
+            self._remove_from_disk(key)
+            return None
+
+        entry = (added, payload)
+        if self._has_expired(entry):
+            self._remove_from_disk(key)
+            return None
+        else:
+            self._record_disk_entry(key, len(data))
+            return entry
+
+    def _remove_from_disk(self, key):
+        with self._lock:
+            self._forget_disk_entry(key)
+        _remove_if_exists(os.path.join(self._disk_dir, key))
+
+    def _load_disk_entries(self):
+        entries = []
+        for name in os.listdir(self._disk_dir):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._disk_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._record_disk_entry(key, size)
+
+    def _record_disk_entry(self, key, size):
+        with self._lock:
+            self._forget_disk_entry(key)
+            self._disk_entries[key] = size
+            self._disk_size += size
+            evicted = []
+            while self._disk_entries and self._is_disk_over_budget():
+                evicted_key, evicted_size = self._disk_entries.popitem(last=False)
+                self._disk_size -= evicted_size
+                evicted.append(evicted_key)
+
+        for evicted_key in evicted:
+            _remove_if_exists(os.path.join(self._disk_dir, evicted_key))
+
+    def _forget_disk_entry(self, key):
+        size = self._disk_entries.pop(key, None)
+        if size is not None:
+            self._disk_size -= size
+
+    def _is_disk_over_budget(self):
+        return len(self._disk_entries) > self._max_disk_entries or self._disk_size > self._max_disk_bytes
+
+    def _write_to_disk(self, key, entry):
+        if self._disk_dir is None:
+            return
+
+        # Renaming means that readers never see a partly written entry
+        path = os.path.join(self._disk_dir, key)
+        temporary_path = "{0}.{1}.tmp".format(path, os.urandom(16).encode("hex"))
+        data = msgpack.packb((_disk_format_version, ) + entry)
+        try:
+            with open(temporary_path, "wb") as entry_file:
+                entry_file.write(data)
+            os.rename(temporary_path, path)
+        except (IOError, OSError):
+            # The disk tier is only an optimisation
+            _remove_if_exists(temporary_path)
+        else:
+            self._record_disk_entry(key, len(data))
+
+
+class CachingQueryExecutor(object):
+    def __init__(self, executor, cache, namespace):
+        self._executor = executor
+        self._cache = cache
+        self._namespace = namespace
+
+    def execute(self, creation_sql, query, stream=False, explain=False, **kwargs):
+        # Cached results weren't run now, so there's no plan to capture
+        if stream or explain:
+            return self._executor.execute(creation_sql, query, stream=stream, explain=explain, **kwargs)
+
+        return self._cached(
+            creation_sql,
+            query,
+            lambda: self._executor.execute(creation_sql, query, **kwargs),
+        )
+
+    def execute_many(self, creation_sql, queries, timeout=None):
+        results = [self._cached_result(creation_sql, query) for query in queries]
+        missing = [query for query, result in zip(queries, results) if result is None]
+        if missing:
+            new_results = iter(self._executor.execute_many(creation_sql, missing, timeout=timeout))
+            for index, result in enumerate(results):
+                if result is None:
+                    results[index] = next(new_results)
+                    self._add(creation_sql, results[index])
+        return results
+
+    def start(self):
+        self._executor.start()
+
+    def close(self):
+        self._executor.close()
+
+    def _cached(self, creation_sql, query, execute):
+        result = self._cached_result(creation_sql, query)
+        if result is None:
+            result = execute()
+            self._add(creation_sql, result)
+        return result
+
+    def _cached_result(self, creation_sql, query):
+        if not is_deterministic(creation_sql, query):
+            self._cache.record_uncacheable()
+            return None
+        return self._cache.get(result_key(self._namespace, creation_sql, query), query)
+
+    def _add(self, creation_sql, result):
+        if result.error in _uncacheable_errors:
+            return
+        if is_deterministic(creation_sql, result.query):
+            self._cache.add(result_key(self._namespace, creation_sql, result.query), result)
+
+
+def _serialise(result):
+    if result.table is None:
+        return msgpack.packb([result.error, None, None, None, False])
+    else:
+        table = result.table
+        return msgpack.packb([
+            result.error,
+            table.column_names,
+            encode_columns(table.columns),
+            table.row_count,
+            table.truncated,
+        ])
+
+
+def _deserialise(query, payload):
+    error, column_names, columns, row_count, truncated = msgpack.unpackb(payload)
+    if column_names is None:
+        table = None
+    else:
+        table = ResultTable(
+            column_names,
+            columns=decode_columns(columns),
+            row_count=row_count,
+            truncated=truncated,
+        )
+    return Result(query=query, error=error, table=table)
+
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
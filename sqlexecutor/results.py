@@ -1,11 +1,220 @@
+import array
+
+
+timeout_error = "The query took too long to finish"
+
+
 class Result(object):
-    def __init__(self, query, error, table):
+    __slots__ = ["query", "error", "table", "timings", "plan"]
+    
+    def __init__(self, query, error, table, timings=None, plan=None):
         self.query = query
         self.error = error
         self.table = table
+        # Seconds spent in each stage of running the query
+        self.timings = {} if timings is None else timings
+        # Only captured when asked for
+        self.plan = plan
+    
+    @property
+    def truncated(self):
+        return self.table is not None and self.table.truncated
+    
+    @property
+    def row_count(self):
+        if self.table is None:
+            return None
+        else:
+            return self.table.row_count
 
 
-class ResultTable(object):
-    def __init__(self, column_names, rows):
+class QueryPlan(object):
+    # The output of EXPLAIN (or EXPLAIN QUERY PLAN) for a query, along with
+    # what the server reports about running it. Anything that the dialect
+    # can't report is None.
+    __slots__ = ["column_names", "rows", "rows_examined", "server_seconds"]
+    
+    def __init__(self, column_names, rows, rows_examined=None, server_seconds=None):
         self.column_names = column_names
         self.rows = rows
+        self.rows_examined = rows_examined
+        self.server_seconds = server_seconds
+
+
+class ResultTable(object):
+    # Rows may be given either as a list of rows or as a list of columns.
+    # Whichever isn't given is only built if it's asked for.
+    __slots__ = ["column_names", "_rows", "_columns", "_chunks", "_truncated", "_row_count"]
+    
+    def __init__(self, column_names, rows=None, chunks=None, truncated=False, columns=None, row_count=None):
+        self.column_names = column_names
+        self._rows = rows
+        self._columns = columns
+        self._chunks = chunks
+        self._truncated = truncated
+        if rows is not None:
+            self._row_count = len(rows)
+        else:
+            self._row_count = row_count
+    
+    @property
+    def rows(self):
+        if self._rows is None:
+            if self._columns is not None:
+                self._rows = map(list, zip(*self._columns)) if self._columns else []
+            else:
+                self._rows = [row for chunk in self._chunks for row in chunk]
+                self._detach_chunks()
+        return self._rows
+    
+    @property
+    def columns(self):
+        if self._columns is None:
+            builder = ColumnBuilder(len(self.column_names))
+            builder.add_rows(self.rows)
+            self._columns = builder.build()
+        return self._columns
+    
+    @property
+    def truncated(self):
+        if self._chunks is None:
+            return self._truncated
+        else:
+            return self._chunks.truncated
+    
+    @property
+    def row_count(self):
+        # For streamed results, this is the number of rows read so far
+        if self._chunks is None:
+            return self._row_count
+        else:
+            return self._chunks.row_count
+    
+    def chunks(self):
+        # Streamed chunks can only be iterated over once. Any rows that
+        # haven't been read from chunks() are still available from rows.
+        if self._chunks is None:
+            return iter([self.rows])
+        else:
+            return self._chunks
+    
+    def close(self):
+        if self._chunks is not None:
+            self._chunks.close()
+            self._detach_chunks()
+            # Rows that hadn't been read are discarded
+            if self._rows is None and self._columns is None:
+                self._rows = []
+    
+    def _detach_chunks(self):
+        self._truncated = self._chunks.truncated
+        self._row_count = self._chunks.row_count
+        self._chunks = None
+
+
+class ColumnBuilder(object):
+    # Collects rows straight from a cursor into one list per column, so
+    # there's no intermediate list for each row
+    __slots__ = ["_columns"]
+    
+    def __init__(self, column_count):
+        self._columns = [[] for _ in range(column_count)]
+    
+    def add_rows(self, rows):
+        if rows:
+            for column, values in zip(self._columns, zip(*rows)):
+                column.extend(values)
+    
+    def build(self):
+        return map(_compact_column, self._columns)
+
+
+# Columns where every value has one of these exact types are stored in a
+# typed array, which holds the values themselves rather than pointers to
+# boxed objects
+_array_typecodes = {int: "l", float: "d"}
+
+
+def _compact_column(values):
+    if not values:
+        return values
+    
+    value_type = type(values[0])
+    typecode = _array_typecodes.get(value_type)
+    if typecode is None:
+        return values
+    
+    for value in values:
+        if type(value) is not value_type:
+            return values
+    return array.array(typecode, values)
+
+
+def encode_columns(columns):
+    # Typed arrays are sent as their raw bytes, which is much cheaper to pack
+    # and unpack than a msgpack integer or float per value
+    return [
+        (column.typecode, column.tostring()) if isinstance(column, array.array) else ("", column)
+        for column in columns
+    ]
+
+
+def decode_columns(encoded_columns):
+    return [
+        array.array(typecode, values) if typecode else values
+        for typecode, values in encoded_columns
+    ]
+
+
+def serialise_result(result):
+    # Results are sent between processes without their query, since the
+    # receiver already knows what it asked for
+    plan = _serialise_plan(result.plan)
+    if result.table is None:
+        return (result.error, None, None, None, False, result.timings, plan)
+    else:
+        table = result.table
+        return (
+            result.error,
+            table.column_names,
+            encode_columns(table.columns),
+            table.row_count,
+            table.truncated,
+            result.timings,
+            plan,
+        )
+
+
+def deserialise_result(query, serialised):
+    (error, column_names, columns, row_count, truncated, timings, plan) = serialised
+    if column_names is None:
+        table = None
+    else:
+        table = ResultTable(
+            column_names,
+            columns=decode_columns(columns),
+            row_count=row_count,
+            truncated=truncated,
+        )
+    
+    return Result(
+        query=query,
+        error=error,
+        table=table,
+        timings=timings,
+        plan=_deserialise_plan(plan),
+    )
+
+
+def _serialise_plan(plan):
+    if plan is None:
+        return None
+    else:
+        return (plan.column_names, plan.rows, plan.rows_examined, plan.server_seconds)
+
+
+def _deserialise_plan(serialised):
+    if serialised is None:
+        return None
+    else:
+        return QueryPlan(*serialised)
@@ -0,0 +1,211 @@
+import collections
+import re
+import threading
+
+from .snapshots import script_key
+
+
+# Whitespace outside of quoted strings, identifiers and comments doesn't
+# change what a statement means, so it's collapsed before hashing
+_token_regex = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|--[^\n]*\n?|#[^\n]*\n?|/\*.*?\*/|\s+""", re.DOTALL)
+
+# Backslashes escape quotes in MySQL but not in sqlite, and each dialect
+# has its own rules for comments, so statements containing any of these
+# can't be split into tokens reliably
+_untokenisable_regex = re.compile(r"\\|--|#|/\*")
+
+_insert_regex = re.compile(r"^\s*(INSERT\s+INTO\s+[\w`\".]+\s*(?:\([^()'\\]*\))?\s*VALUES)\s*(\(.*?)[\s;]*$", re.IGNORECASE | re.DOTALL)
+
+# Batches are kept well under the default max_allowed_packet of MySQL 5.6,
+# and within the limit on terms in a compound SELECT of sqlite before 3.8.8
+_max_batch_rows = 500
+_max_batch_bytes = 1024 * 1024
+
+
+def normalise_statement(statement):
+    if isinstance(statement, unicode):
+        statement = statement.encode("utf8")
+    if _untokenisable_regex.search(statement):
+        return statement
+    return _token_regex.sub(_normalise_token, statement).strip().rstrip(";").rstrip()
+
+
+def _normalise_token(match):
+    token = match.group(0)
+    if token.isspace():
+        return " "
+    else:
+        return token
+
+
+class PreparedScript(object):
+    __slots__ = ["statements", "key"]
+
+    def __init__(self, statements, key):
+        # The statements to run, which may have had inserts combined
+        self.statements = statements
+        # Creation scripts that only differ in whitespace have the same key
+        self.key = key
+
+
+def prepare_script(creation_script, coalesce=False):
+    key = script_key(map(normalise_statement, creation_script))
+    if coalesce:
+        statements = coalesce_inserts(creation_script)
+    else:
+        statements = list(creation_script)
+    return PreparedScript(statements, key)
+
+
+def coalesce_inserts(statements):
+    # A script that inserts one row per statement would otherwise need a
+    # round trip to the server for each row. Consecutive inserts into the
+    # same columns of the same table are combined into one statement.
+    #
+    # This doesn't always have the same effect as the original script, so
+    # it's only done when asked for:
+    #
+    # * In MySQL's non-strict mode, which is the default for 5.6, errors
+    #   such as NULL in a NOT NULL column become warnings in a multi-row
+    #   insert, and the column's implicit default is stored instead. A
+    #   script that used to fail may succeed with different data.
+    # * LAST_INSERT_ID() and last_insert_rowid() refer to the batch rather
+    #   than to the last row.
+    # * If one row fails, none of the rows in its batch are inserted.
+    # * sqlite before 3.7.11 can't insert more than one row at a time.
+    coalesced = []
+    batch = None
+    for statement in statements:
+        insert = _parse_insert(statement)
+        if batch is not None and batch.can_add(insert):
+            batch.add(insert)
+            continue
+
+        if batch is not None:
+            coalesced.append(batch.statement())
+            batch = None
+        if insert is None:
+            coalesced.append(statement)
+        else:
+            batch = _InsertBatch(insert)
+
+    if batch is not None:
+        coalesced.append(batch.statement())
+    return coalesced
+
+
+class _InsertBatch(object):
+    def __init__(self, insert):
+        self._prefix, self._normalised_prefix, rows = insert
+        self._rows = [rows]
+        self._row_count = 1
+        self._size = len(self._prefix) + len(rows)
+
+    def can_add(self, insert):
+        return (
+            insert is not None and
+            insert[1] == self._normalised_prefix and
+            type(insert[2]) is type(self._rows[0]) and
+            self._row_count < _max_batch_rows and
+            self._size + len(insert[2]) < _max_batch_bytes
+        )
+
+    def add(self, insert):
+        self._rows.append(insert[2])
+        self._row_count += 1
+        self._size += len(insert[2]) + 2
+
+    def statement(self):
+        return self._prefix + " " + ", ".join(self._rows)
+
+
+def _parse_insert(statement):
+    # Returns the start of the statement up to VALUES, that start
+    # normalised, and the rows that are inserted, or None if the statement
+    # is anything other than a plain INSERT ... VALUES
+    if _untokenisable_regex.search(statement):
+        return None
+
+    match = _insert_regex.match(statement)
+    if match is None or not _is_row_list(match.group(2)):
+        return None
+    prefix = match.group(1)
+    return prefix, normalise_statement(prefix), match.group(2)
+
+
+def _is_row_list(text):
+    # Whether the text is only parenthesised rows separated by commas
+    index = 0
+    length = len(text)
+    while True:
+        while index < length and text[index].isspace():
+            index += 1
+        if index == length or text[index] != "(":
+            return False
+
+        depth = 0
+        while True:
+            if index == length:
+                return False
+            char = text[index]
+            if char in "'\"`":
+                index = _end_of_quoted(text, index)
+                if index is None:
+                    return False
+                continue
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            index += 1
+            if depth == 0:
+                break
+
+        while index < length and text[index].isspace():
+            index += 1
+        if index == length:
+            return True
+        if text[index] != ",":
+            return False
+        index += 1
+
+
+def _end_of_quoted(text, start):
+    # Quotes inside are escaped by doubling them
+    quote = text[start]
+    index = start + 1
+    while True:
+        index = text.find(quote, index)
+        if index == -1:
+            return None
+        if text[index + 1:index + 2] == quote:
+            index += 2
+        else:
+            return index + 1
+
+
+class ScriptCache(object):
+    # Prepared scripts are looked up by the exact text of the creation
+    # script, so each distinct script is only prepared once
+
+    def __init__(self, max_scripts=256, coalesce=False):
+        self._max_scripts = max_scripts
+        self._coalesce = coalesce
+        self._scripts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, creation_script):
+        key = script_key(creation_script)
+        with self._lock:
+            prepared = self._scripts.pop(key, None)
+            if prepared is not None:
+                self._scripts[key] = prepared
+                return prepared
+
+        prepared = prepare_script(creation_script, coalesce=self._coalesce)
+        with self._lock:
+            self._scripts[key] = prepared
+            while len(self._scripts) > self._max_scripts:
+                self._scripts.popitem(last=False)
+        return prepared
+
@@ -0,0 +1,57 @@
+import collections
+import hashlib
+
+
+def script_key(creation_script):
+    digest = hashlib.sha1()
+    for statement in creation_script:
+        if isinstance(statement, unicode):
+            statement = statement.encode("utf8")
+        digest.update(statement)
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+class SnapshotCache(object):
+    def __init__(self, max_snapshots=32, max_bytes=256 * 1024 * 1024):
+        self._max_snapshots = max_snapshots
+        self._max_bytes = max_bytes
+        self._snapshots = collections.OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        snapshot = self._snapshots.pop(key, None)
+        if snapshot is not None:
+            self._snapshots[key] = snapshot
+        return snapshot
+
+    def add(self, key, snapshot):
+        if key in self._snapshots:
+            self._remove(key)
+        self._snapshots[key] = snapshot
+        self._size += snapshot.size
+        # The newest snapshot is never evicted since the caller is about to
+        # use it, even if it's bigger than the budget on its own
+        while len(self._snapshots) > 1 and self._is_over_budget():
+            self._remove(next(iter(self._snapshots)))
+
+    def close(self):
+        while self._snapshots:
+            self._remove(next(iter(self._snapshots)))
+
+    def _is_over_budget(self):
+        return len(self._snapshots) > self._max_snapshots or self._size > self._max_bytes
+
+    def _remove(self, key):
+        snapshot = self._snapshots.pop(key)
+        self._size -= snapshot.size
+        snapshot.close()
+
+
+class NoSnapshot(object):
+    # Marks creation scripts that can't be captured, such as those that
+    # create temporary tables, so we don't keep trying to snapshot them
+    size = 0
+
+    def close(self):
+        pass
@@ -2,8 +2,8 @@ import tempfile
 import shutil
 
 
-def create_temporary_dir():
-    temporary_dir = tempfile.mkdtemp()
+def create_temporary_dir(dir=None):
+    temporary_dir = tempfile.mkdtemp(dir=dir)
     return TemporaryDirectory(temporary_dir)
 
 
@@ -0,0 +1,96 @@
+import collections
+import threading
+import time
+
+from .results import timeout_error
+
+
+class Timings(object):
+    # Seconds spent in each stage of running a query. Stages that happen
+    # more than once, such as fetching chunks, are added together.
+    
+    def __init__(self):
+        self.stages = {}
+    
+    def stage(self, name):
+        return _Stage(self, name)
+    
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+
+class _Stage(object):
+    def __init__(self, timings, name):
+        self._timings = timings
+        self._name = name
+        self._start = None
+    
+    def __enter__(self):
+        self._start = time.time()
+    
+    def __exit__(self, *args):
+        self._timings.add(self._name, time.time() - self._start)
+
+
+class Metrics(object):
+    # Counts queries, errors, timeouts and restarts, and keeps the most
+    # recent timings of each stage so that percentiles can be reported.
+    # Hooks are called with the name and duration of each stage as each
+    # query finishes, for sending on to other monitoring.
+    
+    def __init__(self, hooks=None, window=1000):
+        self._hooks = list(hooks or [])
+        self._window = window
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._restarts = 0
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=self._window))
+    
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+    
+    def record(self, result):
+        with self._lock:
+            self._queries += 1
+            if result.error == timeout_error:
+                self._timeouts += 1
+            elif result.error is not None:
+                self._errors += 1
+            for name, seconds in result.timings.iteritems():
+                self._samples[name].append(seconds)
+        
+        for name, seconds in result.timings.iteritems():
+            for hook in self._hooks:
+                hook(name, seconds)
+    
+    def record_restart(self):
+        with self._lock:
+            self._restarts += 1
+    
+    def summary(self):
+        with self._lock:
+            return {
+                "queries": self._queries,
+                "errors": self._errors,
+                "timeouts": self._timeouts,
+                "restarts": self._restarts,
+                "stages": dict(
+                    (name, _summarise(samples))
+                    for name, samples in self._samples.iteritems()
+                ),
+            }
+
+
+def _summarise(samples):
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50": _percentile(ordered, 0.5),
+        "p99": _percentile(ordered, 0.99),
+    }
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from nose.tools import istest, assert_equal, assert_raises
+
+from sqlexecutor.daemon import Daemon, DaemonClient, DaemonError
+from sqlexecutor.pool import ExecutorPool
+from sqlexecutor.results import Result, ResultTable
+
+
+@istest
+def queries_are_executed_by_daemon():
+    with _running_daemon(FakeExecutor) as client:
+        result = client.execute(["create table a (x);"], "SELECT 1")
+        assert_equal("SELECT 1", result.query)
+        assert_equal([["SELECT 1"]], result.table.rows)
+
+
+@istest
+def batches_of_queries_are_executed_by_daemon():
+    with _running_daemon(FakeExecutor) as client:
+        results = client.execute_many([], ["SELECT 1", "SELECT 2"])
+        assert_equal([[["SELECT 1"]], [["SELECT 2"]]], [result.table.rows for result in results])
+
+
+@istest
+def requests_from_many_threads_share_one_connection():
+    with _running_daemon(FakeExecutor, size=4) as client:
+        results = []
+        threads = [
+            threading.Thread(target=lambda query=query: results.append(client.execute([], query).query))
+            for query in ["SELECT {0}".format(index) for index in range(20)]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert_equal(sorted("SELECT {0}".format(index) for index in range(20)), sorted(results))
+
+
+@istest
+def slow_queries_do_not_hold_up_other_requests():
+    unblock = threading.Event()
+    
+    def on_execute(query):
+        if query == "SLOW":
+            unblock.wait(5)
+    
+    with _running_daemon(lambda: FakeExecutor(on_execute), size=2) as client:
+        slow = client.submit([], "SLOW")
+        assert_equal("FAST", client.execute([], "FAST").query)
+        assert not slow.done()
+        unblock.set()
+        assert_equal("SLOW", slow.result(5).query)
+
+
+@istest
+def errors_from_executor_are_raised_by_client():
+    def fail(query):
+        raise ValueError("oops")
+    
+    with _running_daemon(lambda: FakeExecutor(fail)) as client:
+        assert_raises(DaemonError, lambda: client.execute([], "SELECT 1"))
+
+
+class _running_daemon(object):
+    def __init__(self, create_executor, size=1):
+        self._create_executor = create_executor
+        self._size = size
+    
+    def __enter__(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._pool = ExecutorPool(self._create_executor, size=self._size)
+        self._daemon = Daemon(os.path.join(self._temp_dir, "daemon.sock"), self._pool)
+        self._thread = threading.Thread(target=self._daemon.serve_forever)
+        self._thread.start()
+        self._client = DaemonClient(os.path.join(self._temp_dir, "daemon.sock"))
+        return self._client
+    
+    def __exit__(self, *args):
+        self._client.close()
+        self._daemon.close()
+        self._thread.join()
+        self._pool.close()
+        shutil.rmtree(self._temp_dir)
+
+
+class FakeExecutor(object):
+    def __init__(self, on_execute=None):
+        self._on_execute = on_execute
+    
+    def start(self):
+        pass
+    
+    def execute(self, creation_sql, query):
+        if self._on_execute is not None:
+            self._on_execute(query)
+        return Result(query=query, error=None, table=ResultTable(["query"], [[query]]))
+    
+    def execute_many(self, creation_sql, queries):
+        return [self.execute(creation_sql, query) for query in queries]
+    
+    def close(self):
+        pass
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+import time
+
+from nose.tools import istest, assert_equal
+
+from sqlexecutor import datadirs
+from sqlexecutor.tempdir import create_temporary_dir
+
+
+@istest
+def copy_strategy_copies_all_files():
+    _assert_strategy_copies_template(datadirs.CopyStrategy())
+
+
+@istest
+def hardlink_strategy_copies_all_files():
+    _assert_strategy_copies_template(datadirs.HardlinkStrategy())
+
+
+@istest
+def hardlink_strategy_only_links_read_only_files():
+    with _create_template() as template:
+        data_dir = datadirs.HardlinkStrategy().create(template.path)
+        try:
+            def inode(path):
+                return os.stat(path).st_ino
+            
+            assert_equal(
+                inode(os.path.join(template.path, "mysql/user.frm")),
+                inode(os.path.join(data_dir.path, "mysql/user.frm")),
+            )
+            assert inode(os.path.join(template.path, "ibdata1")) != inode(os.path.join(data_dir.path, "ibdata1"))
+        finally:
+            data_dir.close()
+
+
+@istest
+def tmpfs_strategy_copies_all_files():
+    with create_temporary_dir() as tmpfs:
+        _assert_strategy_copies_template(datadirs.TmpfsStrategy(tmpfs.path))
+
+
+@istest
+def tmpfs_copy_of_template_is_removed_when_last_data_dir_is_closed():
+    with create_temporary_dir() as tmpfs, _create_template() as template:
+        strategy = datadirs.TmpfsStrategy(tmpfs.path)
+        first = strategy.create(template.path)
+        second = strategy.create(template.path)
+        first.close()
+        assert_equal(3, len(os.listdir(tmpfs.path)))
+        second.close()
+        assert_equal([], os.listdir(tmpfs.path))
+
+
+@istest
+def tmpfs_copy_of_template_is_replaced_when_template_changes():
+    with create_temporary_dir() as tmpfs, _create_template() as template:
+        strategy = datadirs.TmpfsStrategy(tmpfs.path)
+        first = strategy.create(template.path)
+        try:
+            with open(os.path.join(template.path, "ibdata1"), "w") as template_file:
+                template_file.write("rebuilt")
+            second = strategy.create(template.path)
+            try:
+                with open(os.path.join(second.path, "ibdata1")) as copied_file:
+                    assert_equal("rebuilt", copied_file.read())
+            finally:
+                second.close()
+        finally:
+            first.close()
+
+
+@istest
+def tmpfs_copy_of_template_can_be_used_by_several_processes_at_once():
+    with create_temporary_dir() as tmpfs, _create_template() as template:
+        strategy = datadirs.TmpfsStrategy(tmpfs.path)
+        data_dir = strategy.create(template.path)
+        try:
+            process = subprocess.Popen([
+                sys.executable,
+                "-c",
+                "import sys; from sqlexecutor import datadirs; " +
+                "datadirs.TmpfsStrategy(sys.argv[1]).create(sys.argv[2]).close()",
+                tmpfs.path,
+                template.path,
+            ])
+            deadline = time.time() + 10
+            while process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+                assert False, "Second process waited for the first to finish with the copy"
+            assert_equal(0, process.returncode)
+            with open(os.path.join(data_dir.path, "ibdata1")) as copied_file:
+                assert_equal("ibdata1", copied_file.read())
+        finally:
+            data_dir.close()
+        assert_equal([], os.listdir(tmpfs.path))
+
+
+@istest
+def fastest_available_strategy_is_chosen():
+    with _create_template() as template:
+        assert datadirs.choose_strategy(template.path, runs=1) in datadirs.strategies
+
+
+def _assert_strategy_copies_template(strategy):
+    with _create_template() as template:
+        data_dir = strategy.create(template.path)
+        try:
+            for path in ["ibdata1", "mysql/user.frm", "mysql/user.MYD"]:
+                with open(os.path.join(data_dir.path, path)) as copied_file:
+                    assert_equal(path, copied_file.read())
+        finally:
+            data_dir.close()
+
+
+def _create_template():
+    template = create_temporary_dir()
+    os.mkdir(os.path.join(template.path, "mysql"))
+    for path in ["ibdata1", "mysql/user.frm", "mysql/user.MYD"]:
+        with open(os.path.join(template.path, path), "w") as template_file:
+            template_file.write(path)
+    return template
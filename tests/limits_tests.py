@@ -0,0 +1,56 @@
+import os
+
+from nose.tools import istest, assert_equal
+
+import sqlexecutor
+
+
+_working_dir = os.path.join(os.path.dirname(__file__), "../_tests-working-dir")
+
+_slow_query = "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT COUNT(*) FROM numbers"
+
+
+@istest
+def sqlite3_queries_that_use_too_much_cpu_time_result_in_error():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, cpu_seconds=0.1)
+    try:
+        result = query_executor.execute([], _slow_query, timeout=10)
+        assert_equal("The query used too much CPU time", result.error)
+        assert_equal([[1]], query_executor.execute([], "SELECT 1").table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def sqlite3_queries_that_use_too_much_memory_result_in_error():
+    # The heap limit applies to the whole process, so it's only set in a worker
+    query_executor = sqlexecutor.subprocess_executor(
+        "sqlite3",
+        _working_dir,
+        dialect_options={"heap_limit": 50 * 1024 * 1024, "cache_size": 1024 * 1024},
+    )
+    try:
+        result = query_executor.execute([], "SELECT length(randomblob(200000000))")
+        assert_equal("The query used too much memory", result.error)
+        assert_equal([[1]], query_executor.execute([], "SELECT 1").table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def worker_is_restarted_after_exceeding_its_cpu_time_limit():
+    query_executor = sqlexecutor.subprocess_executor(
+        "sqlite3",
+        _working_dir,
+        timeout=10,
+        resource_limits={"cpu_seconds": 0.1},
+    )
+    try:
+        result = query_executor.execute([], _slow_query)
+        assert_equal(
+            "The executor stopped while running the query, possibly because it exceeded its resource limits",
+            result.error,
+        )
+        assert_equal([[1]], query_executor.execute([], "SELECT 1").table.rows)
+    finally:
+        query_executor.close()
@@ -0,0 +1,94 @@
+from nose.tools import istest, assert_equal, assert_raises
+
+from sqlexecutor.mysqlexecutor import MySqlDialect, _set_session_variables, _ServerExitedError
+
+
+@istest
+def default_profile_only_passes_paths_to_mysqld():
+    dialect = MySqlDialect("/tmp/working-dir")
+    assert_equal(
+        [
+            "--no-defaults",
+            "--basedir=.",
+            "--datadir=/data",
+            "--skip-networking",
+            "--socket=/mysql.sock",
+            "--pid-file=/mysql.pid",
+        ],
+        dialect._mysqld_args("/data", "/mysql.pid", "/mysql.sock", None),
+    )
+
+
+@istest
+def ephemeral_profile_turns_off_durability():
+    args = _mysqld_args(MySqlDialect("/tmp/working-dir", profile="ephemeral"))
+    assert "--loose-innodb-flush-log-at-trx-commit=0" in args
+    assert "--loose-innodb-doublewrite=0" in args
+    assert "--loose-performance-schema=0" in args
+
+
+@istest
+def profile_options_can_be_overridden_or_removed():
+    dialect = MySqlDialect(
+        "/tmp/working-dir",
+        profile="ephemeral",
+        mysqld_options={"innodb_buffer_pool_size": "64M", "innodb_doublewrite": None, "max_connections": "20"},
+    )
+    args = _mysqld_args(dialect)
+    assert "--loose-innodb-buffer-pool-size=64M" in args
+    assert "--loose-max-connections=20" in args
+    assert not [arg for arg in args if arg.startswith("--loose-innodb-doublewrite")]
+
+
+@istest
+def unknown_profile_is_rejected():
+    assert_raises(ValueError, lambda: MySqlDialect("/tmp/working-dir", profile="fast"))
+
+
+@istest
+def profiles_with_different_log_files_use_different_data_dir_templates():
+    default_template = MySqlDialect("/tmp/working-dir")._data_dir_template()
+    ephemeral_template = MySqlDialect("/tmp/working-dir", profile="ephemeral")._data_dir_template()
+    assert_equal("/tmp/working-dir/data-5.6.13", default_template)
+    assert default_template != ephemeral_template
+    assert_equal(
+        ephemeral_template,
+        MySqlDialect("/tmp/working-dir", profile="ephemeral", mysqld_options={"performance_schema": "1"})._data_dir_template(),
+    )
+
+
+@istest
+def session_variables_are_set_in_one_statement():
+    assert_equal(
+        ("SET SESSION max_join_size = %s, SESSION tmp_table_size = %s", [1000000, 16777216]),
+        _set_session_variables({"tmp_table_size": 16777216, "max_join_size": 1000000}),
+    )
+
+
+@istest
+def session_variable_names_are_checked():
+    assert_raises(ValueError, lambda: MySqlDialect("/tmp/working-dir", session_variables={"tmp_table_size = 1; --": 1}))
+
+
+@istest
+def server_is_started_again_if_mysqld_exits_while_starting():
+    for networking, expected_attempts in [(True, 2), (False, 1)]:
+        dialect = MySqlDialect("/tmp/working-dir", networking=networking)
+        attempts = []
+        
+        def start_server():
+            attempts.append(len(attempts))
+            if len(attempts) == 1:
+                raise _ServerExitedError()
+            return "server"
+        
+        dialect._start_server = start_server
+        if networking:
+            assert_equal("server", dialect.start_server())
+        else:
+            assert_raises(_ServerExitedError, dialect.start_server)
+        assert_equal(expected_attempts, len(attempts))
+
+
+def _mysqld_args(dialect):
+    return dialect._mysqld_args("/data", "/mysql.pid", "/mysql.sock", None)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from nose.tools import istest, assert_equal
+
+import MySQLdb
+
+from sqlexecutor.mysqlexecutor import _Reclaimer, MySqlServer
+
+
+@istest
+def released_items_are_reclaimed_in_background():
+    reclaimed = []
+    finished = threading.Event()
+    
+    def reclaim(batch):
+        reclaimed.extend(batch)
+        if len(reclaimed) == 3:
+            finished.set()
+        return len(batch), 0
+    
+    reclaimer = _Reclaimer(reclaim)
+    try:
+        for item in ["a", "b", "c"]:
+            reclaimer.add(item)
+        finished.wait(5)
+        assert_equal(["a", "b", "c"], reclaimed)
+    finally:
+        reclaimer.close()
+
+
+@istest
+def counts_include_outstanding_items():
+    started = threading.Event()
+    unblock = threading.Event()
+    
+    def reclaim(batch):
+        started.set()
+        unblock.wait(5)
+        return 0, len(batch)
+    
+    reclaimer = _Reclaimer(reclaim, batch_size=1)
+    try:
+        reclaimer.add("a")
+        reclaimer.add("b")
+        started.wait(5)
+        assert_equal(2, reclaimer.counts()["outstanding"])
+        unblock.set()
+    finally:
+        reclaimer.close()
+
+
+@istest
+def items_in_failed_batch_are_reclaimed_one_at_a_time():
+    reclaimed = []
+    finished = threading.Event()
+    
+    def reclaim(batch):
+        if "bad" in batch:
+            if len(batch) == 1:
+                finished.set()
+            raise MySQLdb.MySQLError()
+        reclaimed.extend(batch)
+        return len(batch), 0
+    
+    reclaimer = _Reclaimer(reclaim, batch_size=3)
+    try:
+        with reclaimer._condition:
+            for item in ["a", "bad", "c"]:
+                reclaimer._queue.append(item)
+            reclaimer._condition.notify()
+        finished.wait(5)
+        _wait_for(lambda: reclaimer.counts()["outstanding"] == 0)
+        assert_equal(["a", "c"], reclaimed)
+        assert_equal((2, 1), (reclaimer.counts()["dropped"], reclaimer.counts()["failed"]))
+    finally:
+        reclaimer.close()
+
+
+@istest
+def reused_slots_are_reclaimed_in_batches_of_their_own():
+    for reuse_databases, batch_size in [(False, 16), (True, 1)]:
+        server = MySqlServer(
+            process=None,
+            temp_dir=None,
+            data_dir=None,
+            socket_path=None,
+            root_password="",
+            reuse_databases=reuse_databases,
+        )
+        try:
+            assert_equal(batch_size, server._reclaimer._batch_size)
+        finally:
+            server._reclaimer.close()
+
+
+def _wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        time.sleep(0.05)
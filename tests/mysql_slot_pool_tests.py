@@ -0,0 +1,102 @@
+import threading
+
+from nose.tools import istest, assert_equal
+
+from sqlexecutor.mysqlexecutor import _SlotPool
+
+
+@istest
+def pool_is_filled_to_high_watermark_in_background():
+    provisioner = FakeProvisioner()
+    pool = _SlotPool(provisioner.provision, low_watermark=1, high_watermark=3)
+    try:
+        provisioner.wait_for_slots(3)
+        assert_equal(0, pool.take().index)
+    finally:
+        pool.close()
+
+
+@istest
+def slots_are_provisioned_on_demand_if_pool_is_empty():
+    provisioner = FakeProvisioner(block=True)
+    pool = _SlotPool(provisioner.provision, low_watermark=1, high_watermark=1)
+    try:
+        provisioner.wait_for_slots(1)
+        assert_equal(1, pool.take().index)
+    finally:
+        provisioner.unblock()
+        pool.close()
+
+
+@istest
+def closing_pool_closes_idle_slots():
+    provisioner = FakeProvisioner()
+    pool = _SlotPool(provisioner.provision, low_watermark=1, high_watermark=2)
+    provisioner.wait_for_slots(2)
+    pool.close()
+    assert all(slot.is_closed for slot in provisioner.slots)
+
+
+@istest
+def slots_that_have_been_idle_too_long_are_closed_instead_of_taken():
+    now = [0]
+    provisioner = FakeProvisioner()
+    pool = _SlotPool(provisioner.provision, low_watermark=0, high_watermark=2, max_idle_seconds=10, clock=lambda: now[0])
+    try:
+        stale = FakeSlot("stale")
+        pool.give_back(stale)
+        now[0] = 5
+        pool.give_back(FakeSlot("fresh"))
+        now[0] = 12
+        assert_equal("fresh", pool.take().index)
+        assert stale.is_closed
+    finally:
+        pool.close()
+
+
+class FakeProvisioner(object):
+    def __init__(self, block=False):
+        self.slots = []
+        self._condition = threading.Condition()
+        self._blocked = block
+    
+    def provision(self):
+        with self._condition:
+            slot = FakeSlot(len(self.slots))
+            self.slots.append(slot)
+            self._condition.notify_all()
+            is_background = threading.current_thread().name != "MainThread"
+            while self._blocked and is_background:
+                self._condition.wait()
+            return slot
+    
+    def unblock(self):
+        with self._condition:
+            self._blocked = False
+            self._condition.notify_all()
+    
+    def wait_for_slots(self, count):
+        with self._condition:
+            while len(self.slots) < count:
+                self._condition.wait(1)
+
+
+class FakeSlot(object):
+    def __init__(self, index):
+        self.index = index
+        self.is_closed = False
+    
+    def close(self):
+        self.is_closed = True
+
+
+@istest
+def slots_can_be_given_back_until_pool_is_at_high_watermark():
+    provisioner = FakeProvisioner()
+    pool = _SlotPool(provisioner.provision, low_watermark=0, high_watermark=1)
+    try:
+        assert pool.give_back(FakeSlot("given back"))
+        assert not pool.give_back(FakeSlot("extra"))
+        assert_equal("given back", pool.take().index)
+    finally:
+        pool.close()
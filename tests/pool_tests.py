@@ -0,0 +1,176 @@
+import threading
+
+from nose.tools import istest, assert_equal, assert_raises
+
+from sqlexecutor.pool import ExecutorPool, PendingResultTimeout
+
+
+@istest
+def queries_are_executed_by_workers():
+    pool = ExecutorPool(FakeExecutor, size=2)
+    try:
+        assert_equal(("create", "SELECT 1"), pool.execute("create", "SELECT 1"))
+    finally:
+        pool.close()
+
+
+@istest
+def queries_are_executed_concurrently_across_workers():
+    barrier = Barrier(2)
+    pool = ExecutorPool(lambda: FakeExecutor(on_execute=barrier.wait), size=2)
+    try:
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(pool.execute([], "SELECT 1")))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert_equal(2, len(results))
+    finally:
+        pool.close()
+
+
+@istest
+def errors_from_executor_are_raised_to_caller():
+    def fail():
+        raise ValueError("oops")
+    
+    pool = ExecutorPool(lambda: FakeExecutor(on_execute=fail), size=1)
+    try:
+        assert_raises(ValueError, lambda: pool.execute([], "SELECT 1"))
+    finally:
+        pool.close()
+
+
+@istest
+def workers_are_started_before_queries_arrive():
+    executors = []
+    
+    def create_executor():
+        executor = FakeExecutor()
+        executors.append(executor)
+        return executor
+    
+    pool = ExecutorPool(create_executor, size=2)
+    try:
+        for executor in executors:
+            assert executor.started.wait(5)
+    finally:
+        pool.close()
+
+
+@istest
+def submitted_queries_call_callbacks_when_done():
+    pool = ExecutorPool(FakeExecutor, size=1)
+    try:
+        finished = threading.Event()
+        results = []
+        
+        def callback(pending_result):
+            results.append(pending_result.result())
+            finished.set()
+        
+        pool.submit("create", "SELECT 1").add_done_callback(callback)
+        finished.wait(5)
+        assert_equal([("create", "SELECT 1")], results)
+    finally:
+        pool.close()
+
+
+@istest
+def callbacks_added_after_query_has_finished_are_called_immediately():
+    pool = ExecutorPool(FakeExecutor, size=1)
+    try:
+        pending_result = pool.submit("create", "SELECT 1")
+        pending_result.result()
+        results = []
+        pending_result.add_done_callback(lambda pending_result: results.append(pending_result.result()))
+        assert_equal([("create", "SELECT 1")], results)
+    finally:
+        pool.close()
+
+
+@istest
+def waiting_for_result_can_time_out():
+    unblock = threading.Event()
+    pool = ExecutorPool(lambda: FakeExecutor(on_execute=lambda: unblock.wait(5)), size=1)
+    try:
+        pending_result = pool.submit([], "SELECT 1")
+        assert_raises(PendingResultTimeout, lambda: pending_result.result(timeout=0.01))
+        assert not pending_result.done()
+    finally:
+        unblock.set()
+        pool.close()
+
+
+@istest
+def queries_with_same_creation_script_go_to_same_worker_when_dispatching_by_creation_script():
+    executors = []
+    
+    def create_executor():
+        executor = FakeExecutor()
+        executors.append(executor)
+        return executor
+    
+    pool = ExecutorPool(create_executor, size=4, dispatch="creation_script")
+    try:
+        for query in ["SELECT 1", "SELECT 2", "SELECT 3"]:
+            pool.execute(["create table a (x);"], query)
+        assert_equal([3], [executor.query_count for executor in executors if executor.query_count])
+    finally:
+        pool.close()
+
+
+@istest
+def batches_of_queries_are_executed_by_a_single_worker():
+    pool = ExecutorPool(FakeExecutor, size=2)
+    try:
+        assert_equal(
+            [("create", "SELECT 1"), ("create", "SELECT 2")],
+            pool.execute_many("create", ["SELECT 1", "SELECT 2"]),
+        )
+    finally:
+        pool.close()
+
+
+@istest
+def unknown_dispatch_is_rejected():
+    assert_raises(ValueError, lambda: ExecutorPool(FakeExecutor, size=1, dispatch="random"))
+
+
+class FakeExecutor(object):
+    def __init__(self, on_execute=None):
+        self._on_execute = on_execute
+        self.started = threading.Event()
+        self.query_count = 0
+    
+    def start(self):
+        self.started.set()
+    
+    def execute(self, creation_sql, query):
+        if self._on_execute is not None:
+            self._on_execute()
+        self.query_count += 1
+        return (creation_sql, query)
+    
+    def execute_many(self, creation_sql, queries):
+        return [self.execute(creation_sql, query) for query in queries]
+    
+    def close(self):
+        pass
+
+
+class Barrier(object):
+    def __init__(self, count):
+        self._count = count
+        self._condition = threading.Condition()
+    
+    def wait(self):
+        with self._condition:
+            self._count -= 1
+            self._condition.notify_all()
+            while self._count > 0:
+                self._condition.wait(5)
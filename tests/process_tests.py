@@ -0,0 +1,36 @@
+import os
+import time
+
+from nose.tools import istest, assert_equal
+
+import sqlexecutor
+from sqlexecutor.tempdir import create_temporary_dir
+
+
+_working_dir = os.path.join(os.path.dirname(__file__), "../_tests-working-dir")
+
+
+@istest
+def workers_remove_their_temporary_files_when_closed():
+    with create_temporary_dir() as temp_dir:
+        original_tmpdir = os.environ.get("TMPDIR")
+        os.environ["TMPDIR"] = temp_dir.path
+        try:
+            query_executor = sqlexecutor.subprocess_executor("sqlite3", _working_dir, snapshot_cache={})
+            query_executor.start()
+        finally:
+            if original_tmpdir is None:
+                del os.environ["TMPDIR"]
+            else:
+                os.environ["TMPDIR"] = original_tmpdir
+
+        try:
+            query_executor.execute(["create table a (x);"], "SELECT x FROM a")
+            assert_equal(1, len(os.listdir(temp_dir.path)))
+        finally:
+            query_executor.close()
+
+        deadline = time.time() + 5
+        while os.listdir(temp_dir.path) and time.time() < deadline:
+            time.sleep(0.05)
+        assert_equal([], os.listdir(temp_dir.path))
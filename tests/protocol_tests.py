@@ -0,0 +1,45 @@
+from nose.tools import istest, assert_equal
+
+from sqlexecutor import protocol
+
+
+@istest
+def messages_can_be_read_after_being_encoded():
+    reader = protocol.FrameReader()
+    reader.feed(protocol.encode(["execute", ["create table a (x);"], "SELECT 1"]))
+    assert_equal([["execute", ["create table a (x);"], "SELECT 1"]], list(reader.messages()))
+
+
+@istest
+def messages_are_only_read_once_whole_frame_has_arrived():
+    reader = protocol.FrameReader()
+    data = protocol.encode(["ready", protocol.VERSION])
+    for byte in data[:-1]:
+        reader.feed(byte)
+        assert_equal([], list(reader.messages()))
+    reader.feed(data[-1])
+    assert_equal([["ready", protocol.VERSION]], list(reader.messages()))
+
+
+@istest
+def multiple_messages_can_be_read_from_one_chunk():
+    reader = protocol.FrameReader()
+    reader.feed(protocol.encode([1]) + protocol.encode([2]) + protocol.encode([3])[:2])
+    assert_equal([[1], [2]], list(reader.messages()))
+
+
+@istest
+def large_messages_are_compressed():
+    message = [None, ["x"], [["a" * 100]] * 1000]
+    data = protocol.encode(message, compression_threshold=1024)
+    assert len(data) < 10000
+    reader = protocol.FrameReader()
+    reader.feed(data)
+    assert_equal([message], list(reader.messages()))
+
+
+@istest
+def compression_can_be_disabled():
+    message = [None, ["x"], [["a" * 100]] * 1000]
+    data = protocol.encode(message, compression_threshold=None)
+    assert len(data) > 100000
@@ -0,0 +1,170 @@
+import os
+import shutil
+import tempfile
+
+import msgpack
+
+from nose.tools import istest, assert_equal
+
+import sqlexecutor
+from sqlexecutor.results import Result, ResultTable
+from sqlexecutor.resultcache import ResultCache, result_key, is_deterministic
+
+
+@istest
+def whitespace_outside_of_strings_is_not_part_of_key():
+    assert_equal(
+        result_key("sqlite3", ["create table a (x);"], "SELECT x FROM a"),
+        result_key("sqlite3", ["create table a\n    (x) ;"], "SELECT  x\nFROM a;"),
+    )
+
+
+@istest
+def whitespace_inside_strings_is_part_of_key():
+    assert result_key("sqlite3", [], "SELECT 'a  b'") != result_key("sqlite3", [], "SELECT 'a b'")
+
+
+@istest
+def newlines_that_end_comments_are_part_of_key():
+    assert result_key("mysql", [], "SELECT 1 #x\n+1") != result_key("mysql", [], "SELECT 1 #x +1")
+    assert result_key("mysql", [], "SELECT 1 -- x\n+1") != result_key("mysql", [], "SELECT 1 -- x +1")
+
+
+@istest
+def queries_calling_non_deterministic_functions_are_not_deterministic():
+    assert is_deterministic([], "SELECT x FROM a")
+    assert not is_deterministic([], "SELECT RAND()")
+    assert not is_deterministic([], "SELECT now()")
+    assert not is_deterministic(["insert into a values (random());"], "SELECT x FROM a")
+    assert not is_deterministic([], "SELECT date('now')")
+    assert not is_deterministic([], "SELECT DATABASE()")
+    assert not is_deterministic([], "SELECT CURRENT_USER")
+    assert not is_deterministic([], "SELECT user ()")
+    assert is_deterministic([], "SELECT user FROM users")
+
+
+@istest
+def least_recently_used_result_is_evicted_when_too_many_results_are_cached():
+    cache = ResultCache(max_entries=2)
+    cache.add("first", _result([[1]]))
+    cache.add("second", _result([[2]]))
+    cache.get("first", "SELECT 1")
+    cache.add("third", _result([[3]]))
+    assert_equal(None, cache.get("second", "SELECT 2"))
+    assert_equal([[1]], cache.get("first", "SELECT 1").table.rows)
+
+
+@istest
+def results_expire_after_ttl():
+    now = [0]
+    cache = ResultCache(ttl=10, clock=lambda: now[0])
+    cache.add("first", _result([[1]]))
+    now[0] = 11
+    assert_equal(None, cache.get("first", "SELECT 1"))
+
+
+@istest
+def results_are_read_from_disk_by_new_caches():
+    disk_dir = tempfile.mkdtemp()
+    try:
+        ResultCache(disk_dir=disk_dir).add("first", _result([[1]]))
+        cache = ResultCache(disk_dir=disk_dir)
+        assert_equal([[1]], cache.get("first", "SELECT 1").table.rows)
+        assert_equal(1, cache.stats()["disk_hits"])
+    finally:
+        shutil.rmtree(disk_dir)
+
+
+@istest
+def disk_entries_in_other_formats_are_removed_and_count_as_misses():
+    disk_dir = tempfile.mkdtemp()
+    try:
+        old_entry = msgpack.packb((0, msgpack.packb([None, ["x"], [[1]], False])))
+        corrupt_entry = msgpack.packb((2, 0, "not a result"))
+        for key, data in [("old", old_entry), ("corrupt", corrupt_entry)]:
+            with open(os.path.join(disk_dir, key), "wb") as entry_file:
+                entry_file.write(data)
+
+        cache = ResultCache(disk_dir=disk_dir)
+        assert_equal(None, cache.get("old", "SELECT 1"))
+        assert_equal(None, cache.get("corrupt", "SELECT 1"))
+        assert_equal(2, cache.stats()["misses"])
+        assert_equal([], os.listdir(disk_dir))
+    finally:
+        shutil.rmtree(disk_dir)
+
+
+@istest
+def least_recently_used_disk_entry_is_removed_when_too_many_are_stored():
+    disk_dir = tempfile.mkdtemp()
+    try:
+        cache = ResultCache(max_entries=1, disk_dir=disk_dir, max_disk_entries=2)
+        cache.add("first", _result([[1]]))
+        cache.add("second", _result([[2]]))
+        cache.get("first", "SELECT 1")
+        cache.add("third", _result([[3]]))
+        assert_equal(["first", "third"], sorted(os.listdir(disk_dir)))
+        assert_equal(2, cache.stats()["disk_entries"])
+
+        cache = ResultCache(disk_dir=disk_dir, max_disk_entries=1)
+        assert_equal(1, len(os.listdir(disk_dir)))
+    finally:
+        shutil.rmtree(disk_dir)
+
+
+@istest
+def repeated_queries_are_served_from_cache():
+    cache = ResultCache()
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, result_cache=cache)
+    try:
+        creation_script = ["create table a (x);", "insert into a values (1);"]
+        first = query_executor.execute(creation_script, "SELECT x FROM a")
+        second = query_executor.execute(creation_script, "SELECT x FROM a")
+        assert_equal([[1]], first.table.rows)
+        assert_equal([[1]], second.table.rows)
+        assert_equal((1, 1), (cache.stats()["hits"], cache.stats()["misses"]))
+    finally:
+        query_executor.close()
+
+
+@istest
+def non_deterministic_queries_are_always_executed():
+    cache = ResultCache()
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, result_cache=cache)
+    try:
+        query_executor.execute([], "SELECT random()")
+        query_executor.execute([], "SELECT random()")
+        assert_equal((0, 2), (cache.stats()["entries"], cache.stats()["uncacheable"]))
+    finally:
+        query_executor.close()
+
+
+@istest
+def results_that_ran_out_of_cpu_time_are_not_cached():
+    cache = ResultCache()
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, result_cache=cache, cpu_seconds=0.05)
+    try:
+        result = query_executor.execute(
+            [],
+            "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT COUNT(*) FROM numbers",
+        )
+        assert_equal("The query used too much CPU time", result.error)
+        assert_equal(0, cache.stats()["entries"])
+    finally:
+        query_executor.close()
+
+
+@istest
+def executors_with_different_limits_do_not_share_results():
+    cache = ResultCache()
+    for cpu_seconds in [10, 100]:
+        query_executor = sqlexecutor.executor("sqlite3", working_dir=None, result_cache=cache, cpu_seconds=cpu_seconds)
+        try:
+            query_executor.execute([], "SELECT 1")
+        finally:
+            query_executor.close()
+    assert_equal((0, 2), (cache.stats()["hits"], cache.stats()["misses"]))
+
+
+def _result(rows):
+    return Result(query="SELECT", error=None, table=ResultTable(["x"], rows))
@@ -0,0 +1,78 @@
+import array
+
+from nose.tools import istest, assert_equal
+
+import sqlexecutor
+from sqlexecutor.results import Result, ResultTable, QueryPlan, ColumnBuilder, encode_columns, decode_columns, serialise_result, deserialise_result
+
+
+@istest
+def numeric_columns_are_stored_in_typed_arrays():
+    builder = ColumnBuilder(3)
+    builder.add_rows([(1, 1.5, "a"), (2, 2.5, "b")])
+    columns = builder.build()
+    assert_equal(array.array("l", [1, 2]), columns[0])
+    assert_equal(array.array("d", [1.5, 2.5]), columns[1])
+    assert_equal(["a", "b"], columns[2])
+
+
+@istest
+def columns_with_mixed_types_are_stored_as_lists():
+    builder = ColumnBuilder(1)
+    builder.add_rows([(1, ), (None, ), (1.5, )])
+    assert_equal([[1, None, 1.5]], builder.build())
+
+
+@istest
+def rows_are_built_from_columns_when_read():
+    table = ResultTable(["x", "y"], columns=[array.array("l", [1, 2]), ["a", "b"]], row_count=2)
+    assert_equal([[1, "a"], [2, "b"]], table.rows)
+    assert_equal(2, table.row_count)
+
+
+@istest
+def columns_are_built_from_rows_when_read():
+    table = ResultTable(["x", "y"], [[1, "a"], [2, "b"]])
+    assert_equal([array.array("l", [1, 2]), ["a", "b"]], table.columns)
+
+
+@istest
+def encoded_columns_can_be_decoded():
+    columns = [array.array("l", [1, 2]), array.array("d", [0.5]), ["a", None]]
+    assert_equal(columns, decode_columns(encode_columns(columns)))
+
+
+@istest
+def query_results_are_stored_as_columns():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        result = query_executor.execute(
+            ["create table a (x, y);", "insert into a values (1, 'one'), (2, 'two');"],
+            "SELECT x, y FROM a ORDER BY x",
+        )
+        assert_equal([array.array("l", [1, 2]), [u"one", u"two"]], result.table.columns)
+        assert_equal([[1, u"one"], [2, u"two"]], result.table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def query_plans_are_kept_when_results_are_serialised():
+    plan = QueryPlan(["id", "detail"], [[2, "SCAN a"]], rows_examined=None, server_seconds=0.5)
+    result = deserialise_result("SELECT x FROM a", serialise_result(Result("SELECT x FROM a", None, None, plan=plan)))
+    assert_equal(
+        (["id", "detail"], [[2, "SCAN a"]], None, 0.5),
+        (result.plan.column_names, result.plan.rows, result.plan.rows_examined, result.plan.server_seconds),
+    )
+
+
+@istest
+def closed_streamed_tables_have_no_rows():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        table = query_executor.execute([], "SELECT 1", stream=True).table
+        table.close()
+        assert_equal([], table.rows)
+        assert_equal([], list(table.chunks())[0])
+    finally:
+        query_executor.close()
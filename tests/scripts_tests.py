@@ -0,0 +1,85 @@
+from nose.tools import istest, assert_equal
+
+import sqlexecutor
+from sqlexecutor.scripts import ScriptCache, coalesce_inserts, prepare_script
+
+
+@istest
+def consecutive_inserts_into_same_table_are_combined():
+    assert_equal(
+        [
+            "create table a (x, y);",
+            "INSERT INTO a (x, y) VALUES (1, 'one'), (2, 'two, (2)'), (3, 'it''s')",
+            "select 1",
+            "insert into a values (4, null)",
+        ],
+        coalesce_inserts([
+            "create table a (x, y);",
+            "INSERT INTO a (x, y) VALUES (1, 'one');",
+            "INSERT INTO a (x, y)  VALUES (2, 'two, (2)')",
+            "INSERT INTO a (x, y) VALUES (3, 'it''s');",
+            "select 1",
+            "insert into a values (4, null)",
+        ]),
+    )
+
+
+@istest
+def inserts_into_different_tables_or_columns_are_not_combined():
+    statements = [
+        "insert into a (x) values (1)",
+        "insert into a (y) values (2)",
+        "insert into b (y) values (3)",
+    ]
+    assert_equal(statements, coalesce_inserts(statements))
+
+
+@istest
+def inserts_with_anything_after_their_rows_are_not_combined():
+    statements = [
+        "insert into a values (1) on duplicate key update x = (1)",
+        "insert into a values (2) -- two",
+        "insert into a values ('\\'')",
+        "insert into a values ('unterminated)",
+        "insert into a values (3)",
+    ]
+    assert_equal(statements, coalesce_inserts(statements))
+
+
+@istest
+def scripts_that_only_differ_in_whitespace_have_same_key():
+    assert_equal(
+        prepare_script(["create table a (x);", "insert into a values ('a  b');"]).key,
+        prepare_script(["create  table a (x)", "insert into a\nvalues ('a  b')"]).key,
+    )
+    assert prepare_script(["insert into a values ('a b')"]).key != prepare_script(["insert into a values ('a  b')"]).key
+
+
+@istest
+def prepared_scripts_are_cached():
+    cache = ScriptCache()
+    creation_script = ["create table a (x);", "insert into a values (1);"]
+    assert cache.prepare(creation_script) is cache.prepare(list(creation_script))
+
+
+@istest
+def inserts_are_only_combined_when_asked_for():
+    creation_script = ["create table a (x);", "insert into a values (1);", "insert into a values (2);"]
+    assert_equal(creation_script, prepare_script(creation_script).statements)
+    assert_equal(2, len(prepare_script(creation_script, coalesce=True).statements))
+
+
+@istest
+def combined_inserts_insert_every_row():
+    creation_script = ["create table a (x);"] + [
+        "insert into a values ({0});".format(value)
+        for value in range(1500)
+    ]
+    assert_equal(4, len(prepare_script(creation_script, coalesce=True).statements))
+
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, coalesce_inserts=True)
+    try:
+        result = query_executor.execute(creation_script, "SELECT COUNT(*), SUM(x) FROM a")
+        assert_equal([[1500, sum(range(1500))]], result.table.rows)
+    finally:
+        query_executor.close()
@@ -0,0 +1,67 @@
+from nose.tools import istest, assert_equal
+
+from sqlexecutor.snapshots import SnapshotCache, script_key
+
+
+@istest
+def creation_scripts_with_same_statements_have_same_key():
+    assert_equal(
+        script_key(["create table a (x);", "insert into a values (1);"]),
+        script_key(["create table a (x);", "insert into a values (1);"]),
+    )
+
+
+@istest
+def statement_boundaries_are_part_of_key():
+    assert script_key(["ab", "c"]) != script_key(["a", "bc"])
+
+
+@istest
+def least_recently_used_snapshot_is_evicted_when_too_many_snapshots_are_cached():
+    cache = SnapshotCache(max_snapshots=2)
+    first, second, third = FakeSnapshot(1), FakeSnapshot(1), FakeSnapshot(1)
+    cache.add("first", first)
+    cache.add("second", second)
+    cache.get("first")
+    cache.add("third", third)
+    assert_equal(None, cache.get("second"))
+    assert second.is_closed
+    assert_equal(first, cache.get("first"))
+    assert_equal(third, cache.get("third"))
+
+
+@istest
+def snapshots_are_evicted_when_cache_is_over_byte_budget():
+    cache = SnapshotCache(max_bytes=10)
+    first = FakeSnapshot(6)
+    cache.add("first", first)
+    cache.add("second", FakeSnapshot(6))
+    assert_equal(None, cache.get("first"))
+    assert first.is_closed
+
+
+@istest
+def newest_snapshot_is_kept_even_if_over_byte_budget():
+    cache = SnapshotCache(max_bytes=10)
+    snapshot = FakeSnapshot(20)
+    cache.add("big", snapshot)
+    assert_equal(snapshot, cache.get("big"))
+    assert not snapshot.is_closed
+
+
+@istest
+def closing_cache_closes_all_snapshots():
+    cache = SnapshotCache()
+    snapshot = FakeSnapshot(1)
+    cache.add("snapshot", snapshot)
+    cache.close()
+    assert snapshot.is_closed
+
+
+class FakeSnapshot(object):
+    def __init__(self, size):
+        self.size = size
+        self.is_closed = False
+    
+    def close(self):
+        self.is_closed = True
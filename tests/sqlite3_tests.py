@@ -1,3 +1,5 @@
+import time
+
 from nose.tools import istest, assert_equal
 
 import sqlexecutor
@@ -69,3 +71,320 @@ def query_results_in_error_if_query_references_non_existant_table():
         "SELECT 1 FROM books"
     )
     assert_equal('no such table: books', result.error)
+
+
+@istest
+def queries_can_be_run_against_snapshot_of_creation_script():
+    query_executor = sqlexecutor.executor(
+        "sqlite3",
+        working_dir=None,
+        snapshot_cache=sqlexecutor.SnapshotCache(),
+    )
+    try:
+        creation_script = [
+            "create table books (title);",
+            "insert into books (title) values ('Orbiting the Giant Hairball');",
+        ]
+        for i in range(2):
+            result = query_executor.execute(creation_script, "SELECT * FROM books")
+            assert_equal(None, result.error)
+            assert_equal([["Orbiting the Giant Hairball"]], result.table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def snapshot_cache_replays_creation_scripts_that_create_temporary_tables():
+    query_executor = sqlexecutor.executor(
+        "sqlite3",
+        working_dir=None,
+        snapshot_cache=sqlexecutor.SnapshotCache(),
+    )
+    try:
+        creation_script = [
+            "create temporary table books (title);",
+            "insert into books (title) values ('Orbiting the Giant Hairball');",
+        ]
+        for i in range(2):
+            result = query_executor.execute(creation_script, "SELECT * FROM books")
+            assert_equal([["Orbiting the Giant Hairball"]], result.table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def snapshot_cache_replays_creation_scripts_that_set_pragmas():
+    query_executor = sqlexecutor.executor(
+        "sqlite3",
+        working_dir=None,
+        snapshot_cache=sqlexecutor.SnapshotCache(),
+    )
+    try:
+        for i in range(2):
+            result = query_executor.execute(["PRAGMA foreign_keys = ON;"], "PRAGMA foreign_keys")
+            assert_equal([[1]], result.table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def rows_can_be_streamed_in_chunks():
+    result = sqlexecutor.executor("sqlite3", working_dir=None).execute(
+        [
+            "create table numbers (value);",
+            "insert into numbers values (1);",
+            "insert into numbers values (2);",
+            "insert into numbers values (3);",
+        ],
+        "SELECT value FROM numbers",
+        stream=True,
+        chunk_size=2,
+    )
+    assert_equal(["value"], result.table.column_names)
+    assert_equal([[[1], [2]], [[3]]], list(result.table.chunks()))
+
+
+@istest
+def streamed_rows_can_be_read_all_at_once():
+    result = sqlexecutor.executor("sqlite3", working_dir=None).execute(
+        [
+            "create table numbers (value);",
+            "insert into numbers values (1);",
+            "insert into numbers values (2);",
+            "insert into numbers values (3);",
+        ],
+        "SELECT value FROM numbers",
+        stream=True,
+        chunk_size=2,
+    )
+    assert_equal([[1], [2], [3]], result.table.rows)
+
+
+@istest
+def streamed_result_can_be_closed_before_reading_all_rows():
+    result = sqlexecutor.executor("sqlite3", working_dir=None).execute(
+        [],
+        "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT value FROM numbers",
+        stream=True,
+        chunk_size=10,
+    )
+    chunks = result.table.chunks()
+    assert_equal([[1], [2]], next(chunks)[:2])
+    result.table.close()
+    assert_equal([], list(chunks))
+
+
+@istest
+def rows_beyond_max_rows_are_not_fetched():
+    result = sqlexecutor.executor("sqlite3", working_dir=None, max_rows=2).execute(
+        [],
+        "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT value FROM numbers",
+    )
+    assert_equal([[1], [2]], result.table.rows)
+    assert_equal(True, result.truncated)
+    assert_equal(2, result.row_count)
+
+
+@istest
+def result_is_not_truncated_if_all_rows_fit_within_max_rows():
+    result = sqlexecutor.executor("sqlite3", working_dir=None, max_rows=2).execute(
+        [],
+        "SELECT 1 UNION ALL SELECT 2",
+    )
+    assert_equal([[1], [2]], result.table.rows)
+    assert_equal(False, result.truncated)
+
+
+@istest
+def rows_beyond_max_result_bytes_are_not_fetched():
+    result = sqlexecutor.executor("sqlite3", working_dir=None, max_result_bytes=25).execute(
+        [],
+        "WITH RECURSIVE words(value) AS (SELECT 'abcdefghij' UNION ALL SELECT value FROM words) SELECT value FROM words",
+    )
+    assert_equal([["abcdefghij"], ["abcdefghij"]], result.table.rows)
+    assert_equal(True, result.truncated)
+
+
+@istest
+def limits_apply_to_streamed_results():
+    result = sqlexecutor.executor("sqlite3", working_dir=None, max_rows=3).execute(
+        [],
+        "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT value FROM numbers",
+        stream=True,
+        chunk_size=2,
+    )
+    assert_equal([[[1], [2]], [[3]]], list(result.table.chunks()))
+    assert_equal(True, result.truncated)
+    assert_equal(3, result.row_count)
+
+
+@istest
+def long_queries_are_cancelled_after_timeout():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        result = query_executor.execute(
+            [],
+            "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT COUNT(*) FROM numbers",
+            timeout=0.1,
+        )
+        assert_equal("The query took too long to finish", result.error)
+    finally:
+        query_executor.close()
+
+
+@istest
+def executor_can_be_used_after_query_is_cancelled():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        query_executor.execute(
+            [],
+            "WITH RECURSIVE numbers(value) AS (SELECT 1 UNION ALL SELECT value + 1 FROM numbers) SELECT COUNT(*) FROM numbers",
+            timeout=0.1,
+        )
+        result = query_executor.execute([], "SELECT 1", timeout=1)
+        assert_equal(None, result.error)
+        assert_equal([[1]], result.table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def stopping_watchdog_waits_for_cancellation_in_progress():
+    cancellations = []
+    
+    def cancel():
+        time.sleep(0.2)
+        cancellations.append("finished")
+    
+    watchdog = sqlexecutor._Watchdog()
+    try:
+        watchdog.start(0, cancel)
+        time.sleep(0.1)
+        watchdog.stop()
+        assert_equal(["finished"], cancellations)
+    finally:
+        watchdog.close()
+
+
+@istest
+def many_queries_can_be_run_against_one_creation_script():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        results = query_executor.execute_many(
+            ["create table numbers (value);", "insert into numbers values (1), (2);"],
+            ["SELECT value FROM numbers ORDER BY value", "SELECT COUNT(*) FROM numbers", "SELECTEROO"],
+        )
+        assert_equal([[1], [2]], results[0].table.rows)
+        assert_equal([[2]], results[1].table.rows)
+        assert_equal('near "SELECTEROO": syntax error', results[2].error)
+    finally:
+        query_executor.close()
+
+
+@istest
+def creation_script_is_only_run_once_for_many_queries():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        results = query_executor.execute_many(
+            ["create table numbers (value);", "insert into numbers values (random());"],
+            ["SELECT value FROM numbers", "SELECT value FROM numbers"],
+        )
+        assert_equal(results[0].table.rows, results[1].table.rows)
+    finally:
+        query_executor.close()
+
+
+@istest
+def connections_are_reused_after_changes_are_rolled_back():
+    server = sqlexecutor.Sqlite3Server()
+    try:
+        snapshot = server.create_snapshot(["create table a (x);", "insert into a values (1);"])
+        connection = server.connect(snapshot=snapshot)
+        connection.cursor().execute("DELETE FROM a")
+        connection.close()
+        
+        reused_connection = server.connect(snapshot=snapshot)
+        cursor = reused_connection.cursor()
+        cursor.execute("SELECT x FROM a")
+        assert reused_connection is connection
+        assert_equal([(1, )], cursor.fetchall())
+        reused_connection.close()
+    finally:
+        server.close()
+
+
+@istest
+def connections_are_not_reused_after_changing_pragmas():
+    server = sqlexecutor.Sqlite3Server()
+    try:
+        connection = server.connect()
+        connection.cursor().execute("PRAGMA foreign_keys = ON")
+        connection.close()
+        assert server.connect() is not connection
+    finally:
+        server.close()
+
+
+@istest
+def pragmas_in_creation_script_apply_to_query():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        creation_script = [
+            "PRAGMA foreign_keys = ON;",
+            "create table a (x primary key);",
+            "create table b (x references a (x));",
+        ]
+        for i in range(2):
+            assert_equal([[1]], query_executor.execute(creation_script, "PRAGMA foreign_keys").table.rows)
+        result = query_executor.execute(creation_script, "INSERT INTO b VALUES (1)")
+        assert_equal("FOREIGN KEY constraint failed", result.error)
+    finally:
+        query_executor.close()
+
+
+@istest
+def number_of_idle_connections_is_limited():
+    server = sqlexecutor.Sqlite3Server(idle_connections=1)
+    try:
+        first, second = server.connect(), server.connect()
+        first.close()
+        second.close()
+        assert server.connect() is second
+        assert server.connect() is not first
+    finally:
+        server.close()
+
+
+@istest
+def query_plan_is_captured_when_asked_for():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None)
+    try:
+        result = query_executor.execute(
+            ["create table a (x, y);", "create index a_x on a (x);"],
+            "SELECT y FROM a WHERE x = 1",
+            explain=True,
+        )
+        assert_equal(None, result.error)
+        assert_equal("detail", result.plan.column_names[-1])
+        assert "USING INDEX a_x" in result.plan.rows[0][-1]
+        assert result.plan.server_seconds >= 0
+        assert_equal(None, query_executor.execute([], "SELECT 1").plan)
+    finally:
+        query_executor.close()
+
+
+@istest
+def server_statistics_are_not_captured_for_truncated_results():
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, max_rows=1)
+    try:
+        result = query_executor.execute(
+            ["create table a (x);", "insert into a values (1), (2);"],
+            "SELECT x FROM a",
+            explain=True,
+        )
+        assert_equal([[1]], result.table.rows)
+        assert_equal(True, result.truncated)
+        assert_equal("SCAN a", result.plan.rows[0][-1])
+        assert_equal(None, result.plan.server_seconds)
+    finally:
+        query_executor.close()
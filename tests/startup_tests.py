@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+from nose.tools import istest, assert_equal
+
+
+@istest
+def importing_sqlexecutor_does_not_import_dialect_dependencies():
+    assert_equal([], _modules_imported_by("import sqlexecutor"))
+
+
+@istest
+def using_sqlite3_does_not_import_mysql_dependencies():
+    assert_equal([], _modules_imported_by(
+        "import sqlexecutor; sqlexecutor.executor('sqlite3', working_dir=None).execute([], 'SELECT 1')"
+    ))
+
+
+def _modules_imported_by(code):
+    # Worker processes are started for every restart, so anything slow to
+    # import that they don't need shouldn't be imported at all
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            code + "; import sys; print ','.join(sorted(name for name in sys.modules if name.split('.')[0] in {0!r}))".format(
+                ("MySQLdb", "spur", "argparse", "uuid", "ctypes")
+            ),
+        ],
+        env=dict(os.environ, PYTHONPATH=os.path.join(os.path.dirname(__file__), "..")),
+    )
+    return filter(None, output.strip().split(","))
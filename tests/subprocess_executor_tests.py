@@ -33,3 +33,12 @@ class SubProcessTests(mysql_tests.MySqlTests):
         )
         assert_equal(result.error, "The query took too long to finish")
 
+
+    @istest
+    def timeout_can_be_extended_for_single_query(self):
+        result = self._executor.execute(
+            [],
+            "SELECT SLEEP(3)",
+            timeout=10,
+        )
+        assert_equal(None, result.error)
@@ -0,0 +1,65 @@
+import threading
+
+from nose.tools import istest, assert_equal
+
+from sqlexecutor import _Spares
+
+
+@istest
+def spares_are_booted_in_background():
+    spawner = FakeSpawner()
+    spares = _Spares(spawner.spawn, count=2)
+    try:
+        spawner.wait_for_spawns(2)
+        assert_equal(0, spares.take().index)
+    finally:
+        spares.close()
+
+
+@istest
+def taking_spare_boots_replacement():
+    spawner = FakeSpawner()
+    spares = _Spares(spawner.spawn, count=1)
+    try:
+        spawner.wait_for_spawns(1)
+        spares.take()
+        spawner.wait_for_spawns(2)
+        assert_equal(1, spares.take().index)
+    finally:
+        spares.close()
+
+
+@istest
+def closing_closes_ready_spares():
+    spawner = FakeSpawner()
+    spares = _Spares(spawner.spawn, count=1)
+    spawner.wait_for_spawns(1)
+    spares.close()
+    assert spawner.executors[0].is_closed
+
+
+class FakeSpawner(object):
+    def __init__(self):
+        self.executors = []
+        self._condition = threading.Condition()
+    
+    def spawn(self):
+        with self._condition:
+            executor = FakeExecutor(len(self.executors))
+            self.executors.append(executor)
+            self._condition.notify_all()
+            return executor
+    
+    def wait_for_spawns(self, count):
+        with self._condition:
+            while len(self.executors) < count:
+                self._condition.wait(1)
+
+
+class FakeExecutor(object):
+    def __init__(self, index):
+        self.index = index
+        self.is_closed = False
+    
+    def close(self):
+        self.is_closed = True
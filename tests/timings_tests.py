@@ -0,0 +1,58 @@
+from nose.tools import istest, assert_equal
+
+import sqlexecutor
+from sqlexecutor.results import Result
+from sqlexecutor.timings import Timings, Metrics
+
+
+@istest
+def repeated_stages_are_added_together():
+    timings = Timings()
+    timings.add("fetch", 1)
+    timings.add("fetch", 2)
+    assert_equal({"fetch": 3}, timings.stages)
+
+
+@istest
+def metrics_count_queries_errors_and_timeouts():
+    metrics = Metrics()
+    metrics.record(Result(query="SELECT 1", error=None, table=None))
+    metrics.record(Result(query="SELECT", error="syntax error", table=None))
+    metrics.record(Result(query="SELECT 1", error="The query took too long to finish", table=None))
+    metrics.record_restart()
+    summary = metrics.summary()
+    assert_equal(
+        (3, 1, 1, 1),
+        (summary["queries"], summary["errors"], summary["timeouts"], summary["restarts"]),
+    )
+
+
+@istest
+def metrics_report_percentiles_of_each_stage():
+    metrics = Metrics()
+    for seconds in range(1, 101):
+        metrics.record(Result(query="SELECT 1", error=None, table=None, timings={"query": seconds}))
+    assert_equal({"count": 100, "p50": 51, "p99": 100}, metrics.summary()["stages"]["query"])
+
+
+@istest
+def hooks_are_called_with_each_stage():
+    stages = []
+    metrics = Metrics(hooks=[lambda name, seconds: stages.append((name, seconds))])
+    metrics.record(Result(query="SELECT 1", error=None, table=None, timings={"query": 2}))
+    assert_equal([("query", 2)], stages)
+
+
+@istest
+def results_include_time_spent_in_each_stage():
+    metrics = Metrics()
+    query_executor = sqlexecutor.executor("sqlite3", working_dir=None, metrics=metrics)
+    try:
+        result = query_executor.execute(["create table a (x);"], "SELECT x FROM a")
+        assert_equal(
+            ["creation_script", "fetch", "provision", "query"],
+            sorted(result.timings.keys()),
+        )
+        assert_equal(1, metrics.summary()["queries"])
+    finally:
+        query_executor.close()